@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import threading
+
+from fake_keepa import FakeKey, make_handler
+from http.server import ThreadingHTTPServer
+
+# Scripted check of the Keepa key pool against fake_keepa running in-process:
+# batches are spread across keys, a bad key is quarantined with an empty bucket,
+# and a key revoked mid-run is benched while its batch moves to a healthy key.
+# Usage: python check_keepa_keys.py
+
+GOOD_KEYS = ['check-key-a', 'check-key-b']
+BAD_KEY = 'check-key-bad'
+START_TOKENS = 1200
+ASINS = [f"B00CHECK{i:02d}" for i in range(12)]
+
+def start_fake_keepa():
+    keys = {key: FakeKey(START_TOKENS, 0) for key in GOOD_KEYS}
+    server = ThreadingHTTPServer(('localhost', 0), make_handler(keys, None, threading.Lock()))
+    server.RequestHandlerClass.log_message = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, keys
+
+def main():
+    server, fake_keys = start_fake_keepa()
+    state_dir = tempfile.mkdtemp()
+    # Configure before gsheets is imported: it builds the key pool and state files at import time
+    os.environ['KEEPA_API_URL'] = f"http://localhost:{server.server_address[1]}"
+    os.environ['KEEPA_API_KEYS'] = ",".join(GOOD_KEYS + [BAD_KEY])
+    os.environ['STATE_SNAPSHOT_FILE'] = os.path.join(state_dir, "runtime_state.json")
+    os.environ['RESULTS_DB_FILE'] = os.path.join(state_dir, "results.db")
+
+    import gsheets
+    from keepa_keys import batch_cost
+    gsheets.REQUEST_INTERVAL = 0
+    pool = gsheets.keepa_keys
+    keys = {k.key: k for k in pool.keys}
+
+    failures = []
+    def check(condition, message):
+        print(f"{'✅' if condition else '❌'} {message}")
+        if not condition:
+            failures.append(message)
+
+    # Four batches of two: the /token probe benches the bad key, the rest alternate
+    for i in range(0, 8, 2):
+        products = gsheets.fetch_keepa_data_batch(ASINS[i:i + 2])
+        check(set(products) == set(ASINS[i:i + 2]), f"batch {ASINS[i:i + 2]} returned every product")
+
+    bad = keys[BAD_KEY]
+    check(bad.quarantined_until > gsheets.time_module.time(), "bad key is quarantined")
+    check(bad.tokens.tokens_left == 0 and not bad.known, "bad key's bucket is emptied and marked for a re-probe")
+    spent = [START_TOKENS - fake_keys[key].tokens for key in GOOD_KEYS]
+    check(spent == [2 * batch_cost(2)] * 2, f"batches balanced across good keys (spent {spent})")
+    check(
+        all(keys[key].tokens.tokens_left == fake_keys[key].tokens for key in GOOD_KEYS),
+        "pool balances match the server after each response"
+    )
+
+    # Revoke a key mid-run: its next batch gets a 402 and is retried on the other key
+    revoked = GOOD_KEYS[0] if keys[GOOD_KEYS[0]].tokens.tokens_left >= keys[GOOD_KEYS[1]].tokens.tokens_left else GOOD_KEYS[1]
+    survivor = GOOD_KEYS[1] if revoked == GOOD_KEYS[0] else GOOD_KEYS[0]
+    del fake_keys[revoked]
+    products = gsheets.fetch_keepa_data_batch(ASINS[8:10])
+    check(set(products) == set(ASINS[8:10]), "batch retried on the surviving key after a 402")
+    check(keys[revoked].tokens.tokens_left == 0 and keys[revoked].quarantined_until > 0, "revoked key is quarantined with an empty bucket")
+    check(START_TOKENS - fake_keys[survivor].tokens == 3 * batch_cost(2), "surviving key was charged for the retried batch")
+
+    server.shutdown()
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("\nAll Keepa key pool checks passed")
+
+if __name__ == "__main__":
+    main()
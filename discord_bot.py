@@ -2,8 +2,16 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
-from gsheets import update_all_sheets, get_all_worksheets, update_sheet
+from keepa_coalescer import KeepaCoalescer, normalise_asin
+from pricing_worker import PricingWorker
+from marketplaces import MARKETPLACES, DEFAULT_MARKETPLACE, parse_marketplaces, calculate_profit
+from job_manager import JobManager, ALL_SHEETS, UPDATE_JOB, MARKETPLACES_JOB
+from state_snapshot import snapshot
+from results_db import results_store, SORT_COLUMNS
+import hashlib
+import json
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -15,16 +23,55 @@ class ProfitBot(commands.Bot):
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix="!", intents=intents)
-        self.active_updates = {}  # Track active updates by channel ID
+        self.worker = PricingWorker()  # Pricing engine runs in its own process
+        # Bot-wide, single-flight jobs
+        self.jobs = JobManager({UPDATE_JOB: self.worker.run, MARKETPLACES_JOB: self.worker.marketplace_view})
+        self.keepa_lookups = KeepaCoalescer(self.worker.price)  # Merges concurrent /price lookups
 
     async def setup_hook(self):
-        await self.tree.sync()
+        self.worker.start()
+        self.jobs.start()
+        # Only sync the command tree when the command definitions have changed
+        commands_json = json.dumps([command.to_dict() for command in self.tree.get_commands()], sort_keys=True)
+        commands_hash = hashlib.sha256(commands_json.encode()).hexdigest()
+        if snapshot.get('command_tree_hash') != commands_hash:
+            await self.tree.sync()
+            snapshot.set('command_tree_hash', commands_hash)
+            print("Synced command tree")
 
     async def on_ready(self):
         print(f"Logged in as {self.user}")
 
+    async def close(self):
+        await asyncio.to_thread(self.worker.shutdown)
+        await super().close()
+
 bot = ProfitBot()
 
+def format_age(seconds):
+    # Compact age for result tables: 45m, 6h, 3d
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)}h"
+    return f"{int(seconds // 86400)}d"
+
+async def join_update(interaction, sheet, kind=UPDATE_JOB, params=None):
+    # Submit (or join) the job covering this sheet and wait for its results
+    job, future, merged = bot.jobs.submit(sheet, interaction.channel_id, kind, params)
+    position = bot.jobs.position(job)
+    if merged:
+        await interaction.channel.send(f"🔗 Joined {job.kind} job #{job.id} ({job.sheet}, {job.status}). Results will be shared when it finishes.")
+    elif position and position > 1:
+        await interaction.channel.send(f"⏳ {job.kind.capitalize()} job #{job.id} queued at position {position}.")
+    try:
+        return await future
+    except asyncio.CancelledError:
+        return None
+    except LookupError as e:
+        await interaction.channel.send(f"❌ {e}")
+        return None
+
 @bot.tree.command(name="update", description="Update profit calculations for sheets")
 @app_commands.describe(sheet="Specify 'all' or a specific tab name to update")
 async def update(interaction: discord.Interaction, sheet: str = "all"):
@@ -34,7 +81,7 @@ async def update(interaction: discord.Interaction, sheet: str = "all"):
         return
 
     # Check if there's already an active update in this channel
-    if interaction.channel_id in bot.active_updates:
+    if bot.jobs.is_subscribed(interaction.channel_id, sheet.lower()):
         await interaction.response.send_message("❌ An update is already in progress in this channel. Use `/stop` to cancel it first.", ephemeral=True)
         return
 
@@ -45,35 +92,9 @@ async def update(interaction: discord.Interaction, sheet: str = "all"):
     await interaction.response.send_message("🔄 Starting update process...")
 
     try:
-        # Mark this channel as having an active update
-        bot.active_updates[interaction.channel_id] = True
-
-        if sheet.lower() == "all":
-            # Process all sheets
-            all_profit_items = await asyncio.to_thread(update_all_sheets)
-        else:
-            # Process specific sheet
-            worksheets = await asyncio.to_thread(get_all_worksheets)
-            target_worksheet = None
-            
-            # Find the specified worksheet
-            for ws in worksheets:
-                if ws.title.lower() == sheet.lower():
-                    target_worksheet = ws
-                    break
-            
-            if not target_worksheet:
-                await interaction.channel.send(f"❌ Sheet '{sheet}' not found.")
-                return
-                
-            # Update single sheet
-            all_profit_items = await asyncio.to_thread(update_sheet, target_worksheet)
-            # Convert to same format as update_all_sheets
-            all_profit_items = {
-                'high_profit': all_profit_items['high_profit'],
-                'medium_profit': all_profit_items['medium_profit'],
-                'low_profit': all_profit_items['low_profit']
-            }
+        all_profit_items = await join_update(interaction, sheet)
+        if all_profit_items is None:
+            return
 
         # Create ping messages for each threshold
         ping_messages = []
@@ -127,14 +148,10 @@ async def update(interaction: discord.Interaction, sheet: str = "all"):
 
     except Exception as e:
         await interaction.channel.send(f"❌ An error occurred: {str(e)}")
-    finally:
-        # Clear the active update flag
-        bot.active_updates.pop(interaction.channel_id, None)
 
 @bot.tree.command(name="stop", description="Stop the current update process")
 async def stop(interaction: discord.Interaction):
-    if interaction.channel_id in bot.active_updates:
-        bot.active_updates.pop(interaction.channel_id)
+    if bot.jobs.cancel_channel(interaction.channel_id):
         await interaction.response.send_message("🛑 Update process will stop after current operation completes.")
     else:
         await interaction.response.send_message("❌ No active update process to stop.", ephemeral=True)
@@ -147,15 +164,16 @@ async def updateall(interaction: discord.Interaction):
         return
 
     # Check if there's already an active update in this channel
-    if interaction.channel_id in bot.active_updates:
+    if bot.jobs.is_subscribed(interaction.channel_id, ALL_SHEETS):
         await interaction.response.send_message("❌ An update is already in progress in this channel. Use `/stop` to cancel it first.", ephemeral=True)
         return
 
     await interaction.response.send_message("🔄 Starting update process for ALL sheets...")
 
     try:
-        bot.active_updates[interaction.channel_id] = True
-        all_profit_items = await asyncio.to_thread(update_all_sheets)
+        all_profit_items = await join_update(interaction, ALL_SHEETS)
+        if all_profit_items is None:
+            return
         # Only process high_profit items (profit margin > 15%)
         if all_profit_items['high_profit']:
             for item in all_profit_items['high_profit']:
@@ -180,12 +198,169 @@ async def updateall(interaction: discord.Interaction):
             await interaction.channel.send("No high profit margin items (>15%) found.")
     except Exception as e:
         await interaction.channel.send(f"❌ An error occurred: {str(e)}")
-    finally:
-        bot.active_updates.pop(interaction.channel_id, None)
-
-# Run the bot
-try:
-    print("Starting bot...")
-    bot.run(DISCORD_TOKEN)
-except Exception as e:
-    print(f"Error starting bot: {e}") 
\ No newline at end of file
+
+@bot.tree.command(name="jobs", description="Show running and queued jobs")
+async def jobs(interaction: discord.Interaction):
+    job_list = bot.jobs.describe()
+    if not job_list:
+        await interaction.response.send_message("✅ No jobs running or queued.", ephemeral=True)
+        return
+
+    embed = discord.Embed(title="📋 Jobs", color=discord.Color.blue())
+    for job in job_list:
+        position = "running" if job['position'] == 0 else f"queue position {job['position']}"
+        target = job['sheet']
+        if job['kind'] == MARKETPLACES_JOB:
+            target = f"{target} on {', '.join(job['params']['marketplaces'])}"
+        embed.add_field(
+            name=f"Job #{job['id']} • {job['kind']} • {target}",
+            value=f"Status: {job['status']} ({position})\nSubscribers: {job['subscribers']}\nWaiting: {job['waiting_seconds']}s"
+                  + (f"\nLast update: {job['progress']}" if job['progress'] else ""),
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="top", description="Top items from the latest results, without touching Sheets or Keepa")
+@app_commands.describe(
+    sort="Column to rank by",
+    limit="Number of items to show (max 25)",
+    sheet="Only include this tab",
+    min_spm="Minimum sales per month",
+    min_roi="Minimum ROI %",
+    min_margin="Minimum profit margin %",
+    max_age_hours="Only include rows priced within this many hours",
+)
+@app_commands.choices(sort=[app_commands.Choice(name=name, value=name) for name in SORT_COLUMNS])
+async def top(interaction: discord.Interaction, sort: str = "roi", limit: int = 20, sheet: str = None,
+              min_spm: int = None, min_roi: float = None, min_margin: float = None, max_age_hours: float = None):
+    limit = max(1, min(limit, 25))
+    try:
+        results = results_store.top(sort=sort, limit=limit, sheet=sheet, min_spm=min_spm, min_roi=min_roi,
+                                    min_margin=min_margin, max_age_hours=max_age_hours)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+
+    if not results:
+        await interaction.response.send_message("No stored results match those filters. Run `/update` first.", ephemeral=True)
+        return
+
+    now = time.time()
+    lines = [f"{'ASIN':<10} {'Buy':>7} {'Sell':>7} {'Profit':>7} {'ROI%':>7} {'Marg%':>6} {'SPM':>5} {'Age':>4} Sheet"]
+    for r in results:
+        lines.append(
+            f"{r['asin']:<10} {r['buy_price']:>7.2f} {r['sell_price']:>7.2f} {r['profit']:>7.2f} "
+            f"{r['roi']:>7.1f} {r['margin']:>6.1f} {r['spm'] or 0:>5} {format_age(now - r['updated_at']):>4} {r['sheet'][:12]}"
+        )
+    header = f"📈 Top {len(results)} by {sort}"
+    await interaction.response.send_message(f"{header}\n```\n" + "\n".join(lines) + "\n```")
+
+@bot.tree.command(name="whatif", description="Break-even and target-margin buy prices for a tab from stored results")
+@app_commands.describe(
+    sheet="Tab name",
+    target_margin="Target profit margin %",
+    sell_change="Sell price change %, e.g. -10 for a 10% buy box drop",
+    referral_rate="Referral fee %",
+    vat_rate="VAT share of the sell price %",
+)
+async def whatif(interaction: discord.Interaction, sheet: str, target_margin: float = 15.0, sell_change: float = 0.0,
+                 referral_rate: float = round(MARKETPLACES[DEFAULT_MARKETPLACE]['referral_rate'] * 100, 2),
+                 vat_rate: float = round(MARKETPLACES[DEFAULT_MARKETPLACE]['vat_rate'] * 100, 2)):
+    # numpy is only loaded once someone asks for a what-if
+    from profit_engine import what_if
+    rows = what_if(sheet, target_margin, sell_change, referral_rate / 100, vat_rate / 100)
+    if not rows:
+        await interaction.response.send_message(f"No stored results for sheet '{sheet}'. Run `/update` first.", ephemeral=True)
+        return
+
+    clearing = sum(1 for r in rows if r['margin'] >= target_margin)
+    lines = [f"{'ASIN':<10} {'Buy':>7} {'Sell':>7} {'Marg%':>6} {'BrkEvn':>7} {'Target':>7}"]
+    for r in rows[:20]:
+        lines.append(
+            f"{r['asin']:<10} {r['buy_price']:>7.2f} {r['sell_price']:>7.2f} {r['margin']:>6.1f} "
+            f"{r['break_even_buy']:>7.2f} {r['target_buy']:>7.2f}"
+        )
+    header = f"🧮 {sheet}: sell {sell_change:+.0f}% → {clearing}/{len(rows)} ASINs clear {target_margin}% margin"
+    await interaction.response.send_message(f"{header}\n```\n" + "\n".join(lines) + "\n```")
+
+@bot.tree.command(name="price", description="Look up the current sell price and profit for an ASIN")
+@app_commands.describe(asin="Amazon ASIN", buy_price="Optional buy price in £ to calculate profit")
+async def price(interaction: discord.Interaction, asin: str, buy_price: float = None):
+    try:
+        asin = normalise_asin(asin)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    await interaction.response.defer(thinking=True)
+    try:
+        result = await bot.keepa_lookups.lookup(asin)
+    except Exception as e:
+        await interaction.followup.send(f"❌ An error occurred: {str(e)}")
+        return
+    if not result:
+        await interaction.followup.send(f"❌ No data found for ASIN {asin}")
+        return
+
+    sell_price = result['sell_price']
+    embed = discord.Embed(title=f"💷 {result['title'] or asin}", color=discord.Color.blue())
+    embed.add_field(name="ASIN", value=f"`{asin}`", inline=True)
+    embed.add_field(name="Sell Price", value=f"£{sell_price}", inline=True)
+    embed.add_field(name="Sellers", value=f"{result['sellers']}", inline=True)
+    embed.add_field(name="SPM", value=f"{result['spm']}", inline=True)
+    embed.add_field(name="FBA Fee", value=f"£{result['fba_fee']}", inline=True)
+    if buy_price is not None:
+        profit, roi = calculate_profit(buy_price, sell_price, result['fba_fee'])
+        profit_margin = round((profit / sell_price) * 100, 2) if sell_price > 0 else 0.0
+        embed.add_field(name="Buy Price", value=f"£{buy_price}", inline=True)
+        embed.add_field(name="Profit", value=f"£{profit}", inline=True)
+        embed.add_field(name="ROI", value=f"{roi}%", inline=True)
+        embed.add_field(name="Profit Margin", value=f"**{profit_margin}%**", inline=True)
+    await interaction.followup.send(embed=embed)
+
+@bot.tree.command(name="marketplaces", description="Compare a tab's margins across Amazon marketplaces and write the best-margin view")
+@app_commands.describe(sheet="Tab name", markets=f"Comma-separated marketplaces ({', '.join(MARKETPLACES)})")
+async def marketplaces(interaction: discord.Interaction, sheet: str, markets: str = ",".join(MARKETPLACES)):
+    # Check if user has admin rights
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ You need administrator rights to use this command.", ephemeral=True)
+        return
+    try:
+        codes = parse_marketplaces(markets)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    if not codes:
+        await interaction.response.send_message("❌ Specify at least one marketplace.", ephemeral=True)
+        return
+
+    params = {'marketplaces': codes}
+    if bot.jobs.is_subscribed(interaction.channel_id, sheet, MARKETPLACES_JOB, params):
+        await interaction.response.send_message("❌ This marketplace view is already in progress in this channel. Use `/stop` to cancel it first.", ephemeral=True)
+        return
+
+    await interaction.response.send_message(f"🌍 Pricing {sheet} on {', '.join(codes)}...")
+    try:
+        summary = await join_update(interaction, sheet, MARKETPLACES_JOB, params)
+        if summary is None:
+            return
+    except Exception as e:
+        await interaction.channel.send(f"❌ An error occurred: {str(e)}")
+        return
+
+    best = "\n".join(f"{code}: {count} ASINs" for code, count in summary['best_counts'].items())
+    embed = discord.Embed(title=f"🌍 Best Marketplace • {summary['sheet']}", color=discord.Color.blue())
+    embed.add_field(name="ASINs Priced", value=f"{summary['asins']}", inline=True)
+    embed.add_field(name="Best Margin By Marketplace", value=best or "None", inline=False)
+    if summary['view']:
+        embed.set_footer(text=f"Full view written to the '{summary['view']}' tab")
+    else:
+        embed.set_footer(text="Stopped before finishing; the existing view was left unchanged")
+    await interaction.channel.send(embed=embed)
+
+# Run the bot (guarded so the pricing worker process can import this module safely)
+if __name__ == "__main__":
+    try:
+        print("Starting bot...")
+        bot.run(DISCORD_TOKEN)
+    except Exception as e:
+        print(f"Error starting bot: {e}") 
\ No newline at end of file
@@ -0,0 +1,126 @@
+import argparse
+import json
+import math
+import threading
+import time as time_module
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the Keepa /product endpoint with per-key token accounting.
+# Usage:
+#   python fake_keepa.py --keys key1,key2 --tokens 1200
+#   KEEPA_API_URL=http://localhost:8765 KEEPA_API_KEYS=key1,key2 python debug_asin.py B000000001
+# Requests are charged like Keepa: 1 token per ASIN plus 6 per page of 10 offers.
+
+class FakeKey:
+    def __init__(self, tokens, refill_rate):
+        self.tokens = tokens
+        self.max_tokens = tokens
+        self.refill_rate = refill_rate  # Tokens per minute
+        self.last_refill = time_module.time()
+
+    def refill(self):
+        now = time_module.time()
+        refilled = int((now - self.last_refill) * self.refill_rate / 60)
+        if refilled > 0:
+            self.tokens = min(self.max_tokens, self.tokens + refilled)
+            self.last_refill = now
+
+    def refill_in_ms(self):
+        return int(60000 / self.refill_rate) if self.refill_rate else 60000
+
+def fake_product(asin, domain):
+    # Deterministic per-ASIN numbers so runs are reproducible
+    seed = sum(ord(c) for c in asin)
+    now_minutes = int(time_module.time() / 60) - 21564000  # Keepa time is minutes since 2011-01-01
+    price = 500 + seed % 4000
+    return {
+        'asin': asin,
+        'domainId': domain,
+        'lastUpdate': now_minutes,
+        'monthlySold': seed % 300,
+        'fbaFees': {'pickAndPackFee': 250 + seed % 200},
+        'stats': {'buyBoxPrice': price},
+        'csv': [[now_minutes - 60, price]],
+        'offers': [],
+    }
+
+def request_cost(asin_count, offers, tokens_per_asin=None):
+    if tokens_per_asin is None:
+        tokens_per_asin = 1 + (6 * math.ceil(offers / 10) if offers else 0)
+    return asin_count * tokens_per_asin
+
+def make_handler(keys, tokens_per_asin, lock):
+    class FakeKeepaHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _token_status(self, key):
+            # Free balance check, like Keepa's /token endpoint
+            with lock:
+                fake_key = keys.get(key)
+                if fake_key is None:
+                    self._send(402, {'error': {'message': 'Invalid API key'}})
+                    return
+                fake_key.refill()
+                payload = {'tokensLeft': fake_key.tokens, 'refillIn': fake_key.refill_in_ms(), 'refillRate': fake_key.refill_rate}
+            self._send(200, payload)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            params = parse_qs(parsed.query)
+            if parsed.path == '/token':
+                self._token_status(params.get('key', [''])[0])
+                return
+            if parsed.path != '/product':
+                self._send(404, {'error': {'message': 'Unknown endpoint'}})
+                return
+
+            key = params.get('key', [''])[0]
+            asins = [a for a in params.get('asin', [''])[0].split(',') if a]
+            domain = int(params.get('domain', ['1'])[0])
+            offers = int(params.get('offers', ['0'])[0])
+            with lock:
+                fake_key = keys.get(key)
+                if fake_key is None:
+                    self._send(402, {'error': {'message': 'Invalid API key'}})
+                    return
+                fake_key.refill()
+                token_info = {'refillIn': fake_key.refill_in_ms(), 'refillRate': fake_key.refill_rate}
+                if fake_key.tokens <= 0:
+                    self._send(429, dict(token_info, tokensLeft=fake_key.tokens, error={'message': 'Not enough tokens'}))
+                    return
+                # Like Keepa, a request may drive the balance negative once it is accepted
+                fake_key.tokens -= request_cost(len(asins), offers, tokens_per_asin)
+                tokens_left = fake_key.tokens
+
+            products = [fake_product(asin, domain) for asin in asins]
+            self._send(200, dict(token_info, tokensLeft=tokens_left, products=products))
+
+        def log_message(self, format, *args):
+            print(f"[fake keepa] {format % args}")
+
+    return FakeKeepaHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Keepa API server with per-key token buckets")
+    parser.add_argument('--keys', required=True, help="Comma-separated API keys to accept")
+    parser.add_argument('--tokens', type=int, default=1200, help="Starting (and max) tokens per key")
+    parser.add_argument('--refill-rate', type=int, default=20, help="Tokens per minute per key")
+    parser.add_argument('--tokens-per-asin', type=int, default=None, help="Flat cost per ASIN (default: Keepa's offers-based cost)")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    keys = {key.strip(): FakeKey(args.tokens, args.refill_rate) for key in args.keys.split(',') if key.strip()}
+    handler = make_handler(keys, args.tokens_per_asin, threading.Lock())
+    server = ThreadingHTTPServer(('localhost', args.port), handler)
+    print(f"Fake Keepa listening on http://localhost:{args.port} with {len(keys)} keys")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
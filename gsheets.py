@@ -1,10 +1,16 @@
-import gspread
 import requests
 import json
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
+from sheet_formatting import get_sheet_formatter
+from sheets_quota import sheets_quota
+from keepa_keys import KeepaKeyPool, KEY_ERROR_STATUS_CODES, KEEPA_OFFERS, batch_cost
+from state_snapshot import snapshot
+from results_db import results_store
+from marketplaces import MARKETPLACES, DEFAULT_MARKETPLACE, to_gbp, from_gbp, format_price, calculate_profit
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time as time_module
 
 # Load environment variables
@@ -14,61 +20,49 @@ load_dotenv()
 SHEET_NAME = "VIK SHEET"
 TAB_NAME = "Rapesco £2500"
 CREDS_PATH = "/etc/secrets/google-sheets-key.json"
-KEEPA_API_KEY = os.getenv('KEEPA_API_KEY')
-PROGRESS_FILE = "progress.json"
+KEEPA_API_URL = os.getenv('KEEPA_API_URL', "https://api.keepa.com")  # Point at a local fake server for testing
+PROGRESS_FILE = "progress.json"  # Legacy checkpoint file, now kept in the state snapshot
 DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL')  # Add this to your .env file
 
 # API rate limiting
 KEEPA_REQUESTS_PER_MINUTE = 20  # Keepa's actual limit
 REQUEST_INTERVAL = 60 / KEEPA_REQUESTS_PER_MINUTE  # Time between requests in seconds
 last_request_time = 0
+rate_limit_lock = threading.Lock()
 BATCH_SIZE = 10  # Number of ASINs to process in one batch
 MAX_ROWS_PER_RUN = 50  # Maximum number of rows to process in one run
 
-# Google Sheets rate limiting
-SHEETS_REQUESTS_PER_MINUTE = 60  # Google Sheets limit
-SHEETS_REQUEST_INTERVAL = 60 / SHEETS_REQUESTS_PER_MINUTE
-last_sheets_request_time = 0
-
-# Token management
-class TokenManager:
-    def __init__(self):
-        self.tokens_left = 1200  # Start with max tokens
-        self.refill_time = 0
-        self.refill_rate = 20  # Tokens per minute
-        self.last_update = time_module.time()
-    
-    def update_from_response(self, response):
-        self.tokens_left = response.get('tokensLeft', self.tokens_left)
-        self.refill_time = response.get('refillIn', 0)
-        self.refill_rate = response.get('refillRate', self.refill_rate)
-        self.last_update = time_module.time()
-    
-    def has_tokens(self):
-        # Update tokens based on time passed
-        current_time = time_module.time()
-        time_passed = current_time - self.last_update
-        if time_passed > 0:
-            tokens_refilled = int(time_passed * (self.refill_rate / 60))
-            self.tokens_left = min(1200, self.tokens_left + tokens_refilled)
-            self.last_update = current_time
-        
-        return self.tokens_left > 0
-    
-    def wait_for_tokens(self):
-        if self.tokens_left <= 0:
-            wait_time = self.refill_time if self.refill_time > 0 else 60
-            print(f"⏳ Waiting {wait_time} seconds for token refill...")
-            time_module.sleep(wait_time)
-            return True
-        return False
+# Amazon fees on the default (UK) marketplace, as a share of the sell price
+REFERRAL_FEE_RATE = MARKETPLACES[DEFAULT_MARKETPLACE]['referral_rate']
+VAT_RATE = MARKETPLACES[DEFAULT_MARKETPLACE]['vat_rate']
 
-# Initialize token manager
-token_manager = TokenManager()
+# Each source tab's per-marketplace best-margin view goes in "<tab> - Marketplaces"
+# (skipped by update_all_sheets)
+MARKETPLACE_VIEW_SUFFIX = " - Marketplaces"
+
+def is_marketplace_view(title):
+    return title.endswith(MARKETPLACE_VIEW_SUFFIX)
+
+# Failed Google Sheets writes are re-queued and retried at the end of each sheet
+WRITE_REQUEUE_ATTEMPTS = 3
+WRITE_REQUEUE_BACKOFF = 30  # Seconds, multiplied by the attempt number
+
+# Keepa keys, each with its own token bucket (KEEPA_API_KEYS=key1,key2,...)
+keepa_keys = KeepaKeyPool.from_env()
+keepa_keys_refreshed = False
 
 # Simple Discord webhook sender using requests
 
+# Optional callback(message, is_error) that also receives every status message,
+# used by the pricing worker to stream progress back to the bot
+progress_hook = None
+
 def send_discord_message(message, is_error=False):
+    if progress_hook:
+        try:
+            progress_hook(message, is_error)
+        except Exception as e:
+            print(f"Failed to report progress: {str(e)}")
     if DISCORD_WEBHOOK_URL:
         try:
             # Add emoji based on message type
@@ -88,58 +82,75 @@ def send_discord_message(message, is_error=False):
             print(f"Failed to send Discord message: {str(e)}")
 
 def rate_limit():
+    # Reserve the next request slot under a lock so concurrent fetches stay spaced out;
+    # requests still overlap while they are in flight
     global last_request_time
-    current_time = time_module.time()
-    time_since_last_request = current_time - last_request_time
-    
-    if time_since_last_request < REQUEST_INTERVAL:
-        sleep_time = REQUEST_INTERVAL - time_since_last_request
-        time_module.sleep(sleep_time)
-    
-    last_request_time = time_module.time()
-
-def sheets_rate_limit():
-    global last_sheets_request_time
-    current_time = time_module.time()
-    time_since_last_request = current_time - last_sheets_request_time
-    
-    if time_since_last_request < SHEETS_REQUEST_INTERVAL:
-        sleep_time = SHEETS_REQUEST_INTERVAL - time_since_last_request
-        time_module.sleep(sleep_time)
+    with rate_limit_lock:
+        current_time = time_module.time()
+        next_slot = max(current_time, last_request_time + REQUEST_INTERVAL)
+        last_request_time = next_slot
     
-    last_sheets_request_time = time_module.time()
-
-def fetch_keepa_data_batch(asins):
+    if next_slot > current_time:
+        time_module.sleep(next_slot - current_time)
+
+def refresh_keepa_token_state():
+    # Keys with no saved state, or just out of quarantine, ask Keepa for their real
+    # balance (the /token call is free) instead of assuming a full bucket
+    global keepa_keys_refreshed
+    keepa_keys_refreshed = True
+    for keepa_key in keepa_keys.unknown_keys():
+        try:
+            r = requests.get(f"{KEEPA_API_URL}/token?key={keepa_key.key}", timeout=10)
+            if r.status_code in KEY_ERROR_STATUS_CODES:
+                keepa_keys.record_error(keepa_key, f"HTTP {r.status_code}", fatal=True)
+                continue
+            keepa_keys.record_response(keepa_key, r.json())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"⚠️ Could not fetch token status for Keepa key {keepa_key.fingerprint}: {str(e)}")
+            keepa_keys.record_error(keepa_key, e)
+
+def fetch_keepa_data_batch(asins, domain=MARKETPLACES[DEFAULT_MARKETPLACE]['domain']):
+    if not keepa_keys_refreshed or keepa_keys.unknown_keys():
+        refresh_keepa_token_state()
     rate_limit()  # Apply rate limiting
     
-    # Check if we have tokens before making request
-    if not token_manager.has_tokens():
-        if token_manager.wait_for_tokens():
-            return fetch_keepa_data_batch(asins)  # Retry after waiting
-    
     # Join ASINs with commas for the batch request
     asin_string = ",".join(asins)
-    url = f"https://api.keepa.com/product?key={KEEPA_API_KEY}&domain=2&asin={asin_string}&buybox=1&offers=40"
     
     max_retries = 3
     retry_count = 0
     
     while retry_count < max_retries:
+        # Send the batch to whichever key has the most budget left
+        keepa_key = keepa_keys.acquire(batch_cost(len(asins)))
+        if keepa_key is None:
+            if not keepa_keys.wait_for_tokens():
+                print("❌ No Keepa API keys configured")
+                return {}
+            continue
+        url = f"{KEEPA_API_URL}/product?key={keepa_key.key}&domain={domain}&asin={asin_string}&buybox=1&offers={KEEPA_OFFERS}"
+        
         try:
             r = requests.get(url)
+            if r.status_code in KEY_ERROR_STATUS_CODES:
+                keepa_keys.record_error(keepa_key, f"HTTP {r.status_code}", fatal=True)
+                retry_count += 1
+                continue
             data = r.json()
             
-            # Update token manager with response data
-            token_manager.update_from_response(data)
+            # Update this key's token bucket with response data
+            keepa_keys.record_response(keepa_key, data)
             
             # Check for API errors
             if "error" in data:
                 error_msg = data.get("error", {}).get("message", "Unknown error")
                 if "tokens" in error_msg.lower():
-                    print(f"⚠️ Keepa API token limit reached. Tokens left: {token_manager.tokens_left}, Refill in: {token_manager.refill_time} seconds")
-                    if token_manager.wait_for_tokens():
-                        retry_count += 1
-                        continue
+                    print(f"⚠️ Keepa API token limit reached on key {keepa_key.fingerprint}. Tokens left: {keepa_key.tokens.tokens_left}, Refill in: {keepa_key.tokens.refill_time} seconds")
+                    # Another key may still have budget; otherwise wait for the soonest refill
+                    if not keepa_keys.has_tokens():
+                        keepa_keys.wait_for_tokens()
+                    retry_count += 1
+                    continue
                 else:
                     print(f"⚠️ Keepa API error: {error_msg}")
                     print(f"Request URL: {url}")
@@ -165,12 +176,14 @@ def fetch_keepa_data_batch(asins):
             
         except requests.exceptions.RequestException as e:
             print(f"⚠️ Network error while fetching batch: {str(e)}")
+            keepa_keys.record_error(keepa_key, e)
             retry_count += 1
             time_module.sleep(5)  # Wait 5 seconds before retrying
             continue
         except json.JSONDecodeError as e:
             print(f"⚠️ Invalid JSON response for batch: {str(e)}")
             print(f"Response text: {r.text}")
+            keepa_keys.record_error(keepa_key, e)
             retry_count += 1
             time_module.sleep(5)
             continue
@@ -403,34 +416,93 @@ def count_fba_sellers(product_data):
 
 
 
+def extract_sell_price(product_data):
+    stats = product_data.get("stats") or {}
+
+    # Get both sell price and seller count in one pass
+    sell_price, sellers = process_offers(product_data)
+    if sell_price == 0.0:
+        sell_price = round(stats.get("buyBoxPrice", 0) / 100, 2)  # Then try buyBoxPrice
+    if sell_price == 0.0:
+        sell_price = extract_current_price_from_csv(product_data)
+    if sell_price == 0.0:
+        sell_price = extract_latest_price(product_data.get("buyBoxPriceHistory", []))
+    return sell_price, sellers
+
 # --- CALCULATE PROFIT ---
-def calculate_profits(buy_price, sell_price, fba_fees):
-    referral_fee = round(sell_price * 0.15, 2)
+def calculate_profits(buy_price, sell_price, fba_fees, marketplace=DEFAULT_MARKETPLACE):
+    # All amounts are in the marketplace's own currency
     fba_fee = round(fba_fees.get("pickAndPackFee", 0) / 100, 2) if fba_fees else 0.0
-    VAT_fee = round(sell_price * 0.16, 2)
-    profit_per_unit = round(sell_price - referral_fee - fba_fee - buy_price - VAT_fee, 2)
-    roi = round((profit_per_unit / buy_price) * 100, 2) if buy_price > 0 else 0
-    return profit_per_unit, roi
+    return calculate_profit(buy_price, sell_price, fba_fee, marketplace)
+
+def price_products(asins, domain=MARKETPLACES[DEFAULT_MARKETPLACE]['domain']):
+    # Keepa lookup reduced to plain numbers, so callers outside this process never see raw product data
+    products = fetch_keepa_data_batch(asins, domain)
+    priced = {}
+    for asin in asins:
+        product_data = products.get(asin)
+        if not product_data:
+            priced[asin] = None
+            continue
+        sell_price, sellers = extract_sell_price(product_data)
+        fba_fees = product_data.get("fbaFees") or {}
+        priced[asin] = {
+            'asin': asin,
+            'title': product_data.get('title'),
+            'sell_price': sell_price,
+            'sellers': sellers,
+            'spm': product_data.get('monthlySold') or 0,
+            'fba_fee': round(fba_fees.get('pickAndPackFee', 0) / 100, 2),
+        }
+    return priced
 
 
 # --- MAIN PROCESS ---
+sheets_client = None
+
+def get_sheets_client():
+    # gspread and oauth2client are only imported once Sheets are actually needed
+    global sheets_client
+    if sheets_client is None:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDS_PATH, scope)
+        sheets_client = gspread.authorize(creds)
+    return sheets_client
+
 def get_all_worksheets():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(CREDS_PATH, scope)
-    client = gspread.authorize(creds)
-    spreadsheet = client.open(SHEET_NAME)
-    return spreadsheet.worksheets()
+    client = get_sheets_client()
+    index = snapshot.get('spreadsheet_index')
 
-def save_progress(sheet_title, last_processed_row):
+    # Reopen by cached ID to skip the Drive search; the tab list is always read fresh
+    # so new, renamed and deleted tabs are picked up straight away
+    spreadsheet = None
+    if index and index.get('sheet_name') == SHEET_NAME:
+        try:
+            spreadsheet = sheets_quota.call('read', client.open_by_key, index['spreadsheet_id'])
+        except Exception as e:
+            print(f"⚠️ Could not reopen spreadsheet by ID, searching by name: {str(e)}")
+    if spreadsheet is None:
+        spreadsheet = sheets_quota.call('read', client.open, SHEET_NAME)
+        snapshot.set('spreadsheet_index', {'sheet_name': SHEET_NAME, 'spreadsheet_id': spreadsheet.id})
+
+    return sheets_quota.call('read', spreadsheet.worksheets)
+
+def save_progress(sheet_title, last_processed_row, pass_started_at=None):
     progress = {
         'sheet_title': sheet_title,
         'last_processed_row': last_processed_row,
+        'pass_started_at': pass_started_at,  # When the pass over this sheet began, kept across resumes
         'timestamp': datetime.now().isoformat()
     }
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(progress, f)
+    snapshot.set('checkpoint', progress)
 
 def load_progress():
+    progress = snapshot.get('checkpoint')
+    if progress:
+        return progress
+    # Fall back to a checkpoint written before the snapshot existed
     if not os.path.exists(PROGRESS_FILE):
         return None
     try:
@@ -439,18 +511,46 @@ def load_progress():
     except:
         return None
 
-def update_sheet(ws):
+def clear_progress():
+    snapshot.pop('checkpoint')
+    if os.path.exists(PROGRESS_FILE):
+        os.remove(PROGRESS_FILE)
+
+def flush_pending_writes(ws, pending_writes):
+    # Retry failed row writes as a single batched write per attempt
+    attempt = 0
+    while pending_writes and attempt < WRITE_REQUEUE_ATTEMPTS:
+        attempt += 1
+        print(f"🔄 Retrying {len(pending_writes)} queued row writes in {ws.title} (attempt {attempt}/{WRITE_REQUEUE_ATTEMPTS})")
+        try:
+            sheets_quota.call('write', ws.batch_update, pending_writes)
+            pending_writes.clear()
+        except Exception as e:
+            print(f"⚠️ Queued row writes failed: {str(e)}")
+            # Back off only when another attempt will follow
+            if attempt < WRITE_REQUEUE_ATTEMPTS:
+                time_module.sleep(WRITE_REQUEUE_BACKOFF * attempt)
+
+    if pending_writes:
+        failed_ranges = ", ".join(write['range'] for write in pending_writes)
+        error_msg = f"Error updating rows in {ws.title} after {WRITE_REQUEUE_ATTEMPTS} retries: {failed_ranges}"
+        print(f"⚠️ {error_msg}")
+        send_discord_message(error_msg, is_error=True)
+
+def update_sheet(ws, stop_event=None):
     progress = load_progress()
     start_row = 0
+    pass_started_at = time_module.time()
     
     # If we have progress and it's for this sheet, resume from last position
     if progress and progress['sheet_title'] == ws.title:
         start_row = progress['last_processed_row']
+        pass_started_at = progress.get('pass_started_at')  # None for checkpoints from older versions
         message = f"Resuming from row {start_row} in sheet {ws.title}"
         print(message)
         send_discord_message(message)
     
-    rows = ws.get_all_values()[1:]  # Skip header
+    rows = sheets_quota.call('read', ws.get_all_values)[1:]  # Skip header
     total_rows = len(rows)
     processed_rows = 0
     profit_items = {
@@ -458,59 +558,11 @@ def update_sheet(ws):
         'medium_profit': [],  # >50% margin
         'low_profit': []      # >30% margin
     }
+    pending_writes = []  # Row writes that failed and are waiting for a retry
 
-    # Get the spreadsheet object and sheet ID for conditional formatting
-    spreadsheet = ws.spreadsheet
-    sheet_id = ws.id
-    
-    # Define the conditional formatting rules
-    rules = [
-        {
-            'ranges': [{'sheetId': sheet_id, 'startRowIndex': 1, 'endRowIndex': len(rows)+1, 'startColumnIndex': 8, 'endColumnIndex': 9}],  # Column I
-            'booleanRule': {
-                'condition': {'type': 'NUMBER_GREATER', 'values': [{'userEnteredValue': '30'}]},
-                'format': {'backgroundColor': {'red': 1.0, 'green': 1.0, 'blue': 0.0}}  # Yellow
-            }
-        },
-        {
-            'ranges': [{'sheetId': sheet_id, 'startRowIndex': 1, 'endRowIndex': len(rows)+1, 'startColumnIndex': 8, 'endColumnIndex': 9}],  # Column I
-            'booleanRule': {
-                'condition': {'type': 'NUMBER_GREATER', 'values': [{'userEnteredValue': '50'}]},
-                'format': {'backgroundColor': {'red': 0.7, 'green': 0.9, 'blue': 1.0}}  # Light Blue
-            }
-        },
-        {
-            'ranges': [{'sheetId': sheet_id, 'startRowIndex': 1, 'endRowIndex': len(rows)+1, 'startColumnIndex': 8, 'endColumnIndex': 9}],  # Column I
-            'booleanRule': {
-                'condition': {'type': 'NUMBER_GREATER', 'values': [{'userEnteredValue': '100'}]},
-                'format': {'backgroundColor': {'red': 0.7, 'green': 1.0, 'blue': 0.7}}  # Green
-            }
-        }
-    ]
-    
-    # Clear existing rules and add new ones
-    requests = [
-        {
-            'deleteConditionalFormatRule': {
-                'sheetId': sheet_id,
-                'index': 0
-            }
-        }
-    ]
-    
-    # Add new rules
-    for rule in rules:
-        requests.append({
-            'addConditionalFormatRule': {
-                'rule': rule
-            }
-        })
-    
+    # Only send formatting changes when the tab's rules or number formats have drifted
     try:
-        sheets_rate_limit()  # Apply rate limiting before Google Sheets API call
-        spreadsheet.batch_update({
-            'requests': requests
-        })
+        get_sheet_formatter(ws.spreadsheet).sync(ws)
     except Exception as e:
         error_msg = f"Error updating conditional formatting: {str(e)}"
         print(f"⚠️ {error_msg}")
@@ -520,6 +572,14 @@ def update_sheet(ws):
     # Process rows in batches
     i = start_row
     while i < len(rows):
+        # Stop between batches if the job was cancelled; progress is already saved
+        if stop_event and stop_event.is_set():
+            message = f"Update stopped at row {i} in sheet {ws.title}"
+            print(f"\n🛑 {message}")
+            send_discord_message(message)
+            flush_pending_writes(ws, pending_writes)
+            return profit_items
+
         # Check if we've hit the max rows per run
         if i >= start_row + MAX_ROWS_PER_RUN:
             message = f"Paused after processing {MAX_ROWS_PER_RUN} rows. Waiting for token refill..."
@@ -527,10 +587,10 @@ def update_sheet(ws):
             send_discord_message(message)
             
             # Wait for token refill
-            if token_manager.wait_for_tokens():
+            if keepa_keys.wait_for_tokens():
                 # Update start position and continue
                 start_row = i
-                save_progress(ws.title, start_row)
+                save_progress(ws.title, start_row, pass_started_at)
                 message = f"Resuming from row {start_row}"
                 print(message)
                 send_discord_message(message)
@@ -539,12 +599,14 @@ def update_sheet(ws):
                 message = "No tokens available. Please run the script again later."
                 print(message)
                 send_discord_message(message, is_error=True)
+                flush_pending_writes(ws, pending_writes)
                 return profit_items
         
         batch_rows = rows[i:i + BATCH_SIZE]
         batch_asins = []
         batch_indices = []
         batch_buy_prices = []
+        batch_details = []  # (brand, asin_url) per ASIN
         
         # Collect ASINs and buy prices for the batch
         for idx, row in enumerate(batch_rows, start=i+2):
@@ -559,6 +621,7 @@ def update_sheet(ws):
                 batch_asins.append(asin)
                 batch_indices.append(idx)
                 batch_buy_prices.append(buy_price)
+                batch_details.append((brand, asin_url))
             except:
                 print(f"Invalid buy price in row {idx}. Skipping.")
                 continue
@@ -575,28 +638,20 @@ def update_sheet(ws):
         print(f"Processing batch of {len(batch_asins)} ASINs: {', '.join(batch_asins)}")
         
         # Save progress after each batch
-        save_progress(ws.title, i + len(batch_rows))
+        save_progress(ws.title, i + len(batch_rows), pass_started_at)
         
         # Fetch data for the batch
         batch_data = fetch_keepa_data_batch(batch_asins)
         
         # Process each ASIN in the batch
-        for asin, idx, buy_price in zip(batch_asins, batch_indices, batch_buy_prices):
+        batch_results = []
+        for asin, idx, buy_price, (brand, asin_url) in zip(batch_asins, batch_indices, batch_buy_prices, batch_details):
             product_data = batch_data.get(asin)
             if not product_data:
                 print(f"No data for ASIN {asin}")
                 continue
 
-            stats = product_data.get("stats") or {}
-
-            # Get both sell price and seller count in one pass
-            sell_price, sellers = process_offers(product_data)
-            if sell_price == 0.0:
-                sell_price = round(stats.get("buyBoxPrice", 0) / 100, 2)  # Then try buyBoxPrice
-            if sell_price == 0.0:
-                sell_price = extract_current_price_from_csv(product_data)
-            if sell_price == 0.0:
-                sell_price = extract_latest_price(product_data.get("buyBoxPriceHistory", []))
+            sell_price, sellers = extract_sell_price(product_data)
 
             spm = product_data.get("monthlySold") or 0
 
@@ -610,10 +665,27 @@ def update_sheet(ws):
             print(f"Buy: £{buy_price} | Sell: £{sell_price} | SPM: {spm} | Sellers: {sellers}")
             print(f"Profit/unit: £{profit} | Profit Margin: {profit_margin}% | ROI: {roi}%")
 
+            batch_results.append({
+                'asin': asin,
+                'sheet': ws.title,
+                'row': idx,
+                'brand': brand,
+                'buy_price': buy_price,
+                'sell_price': sell_price,
+                'profit': profit,
+                'roi': roi,
+                'margin': profit_margin,
+                'spm': spm,
+                'sellers': sellers,
+                'fba_fee': round(fba_fees.get("pickAndPackFee", 0) / 100, 2),
+                'updated_at': time_module.time(),
+            })
+
             # Only notify and add to high_profit if margin > 15%
             if profit_margin > 15:
                 profit_item = {
                     'asin': asin,
+                    'sheet': ws.title,
                     'asin_url': asin_url,
                     'brand': brand,
                     'buy_price': buy_price,
@@ -625,37 +697,59 @@ def update_sheet(ws):
                 }
                 profit_items['high_profit'].append(profit_item)
 
+            # Batch update A, E, F, G, H, I (preserving B-D)
+            # Raw numbers; the column number formats handle £ and % display
+            values = [[
+                sell_price,            # D
+                roi,                   # E
+                profit,                # F
+                spm,                   # G
+                sellers,               # H
+                profit_margin,         # I
+            ]]
             try:
-                # Batch update A, E, F, G, H, I (preserving B-D)
-                sheets_rate_limit()  # Apply rate limiting before Google Sheets API call
-                values = [[
-                    f"£{sell_price}",      # D
-                    f"{roi:.2f}%",         # E
-                    f"£{profit}",          # F
-                    spm,                   # G
-                    sellers,               # H
-                    f"{profit_margin}%",   # I
-                ]]
-                ws.update(f"D{idx}:I{idx}", values)
+                sheets_quota.call('write', ws.update, f"D{idx}:I{idx}", values)
             except Exception as e:
-                error_msg = f"Error updating row {idx}: {str(e)}"
-                print(f"⚠️ {error_msg}")
-                send_discord_message(error_msg, is_error=True)
+                # Re-queue the row instead of dropping it
+                print(f"⚠️ Error updating row {idx}, queued for retry: {str(e)}")
+                pending_writes.append({'range': f"D{idx}:I{idx}", 'values': values})
                 continue
+
+        # Keep a local, queryable record of every computed row
+        try:
+            results_store.record(batch_results)
+        except Exception as e:
+            print(f"⚠️ Could not save results to the local database: {str(e)}")
         
         i += BATCH_SIZE
 
-    # If we've processed all rows, clear the progress file
-    if os.path.exists(PROGRESS_FILE):
-        os.remove(PROGRESS_FILE)
+    flush_pending_writes(ws, pending_writes)
+
+    # A full pass touched every row still in the sheet, so anything older is stale
+    if pass_started_at:
+        try:
+            pruned = results_store.prune(ws.title, pass_started_at)
+            if pruned:
+                print(f"🧹 Removed {pruned} stale results for sheet {ws.title}")
+        except Exception as e:
+            print(f"⚠️ Could not prune stale results: {str(e)}")
+
+    # If we've processed all rows, clear the checkpoint
+    clear_progress()
     completion_message = f"Completed processing sheet {ws.title}"
     print(f"✅ {completion_message}")
     send_discord_message(completion_message)
 
     return profit_items
 
-def update_all_sheets():
+def update_all_sheets(stop_event=None):
     worksheets = get_all_worksheets()
+    if worksheets:
+        # Read the formatting state of every tab in a single metadata call
+        try:
+            get_sheet_formatter(worksheets[0].spreadsheet).load(worksheets)
+        except Exception as e:
+            print(f"⚠️ Could not prefetch sheet formatting: {str(e)}")
     all_profit_items = {
         'high_profit': [],
         'medium_profit': [],
@@ -663,8 +757,12 @@ def update_all_sheets():
     }
     
     for ws in worksheets:
+        if stop_event and stop_event.is_set():
+            break
+        if is_marketplace_view(ws.title):
+            continue
         print(f"\nProcessing sheet: {ws.title}")
-        profit_items = update_sheet(ws)
+        profit_items = update_sheet(ws, stop_event)
         
         # Merge results
         for category in all_profit_items:
@@ -672,5 +770,97 @@ def update_all_sheets():
     
     return all_profit_items
 
+def fetch_keepa_data_multi(asins, marketplaces):
+    # One request per marketplace, in flight together and drawing on the same key pool
+    with ThreadPoolExecutor(max_workers=len(marketplaces)) as executor:
+        futures = {code: executor.submit(fetch_keepa_data_batch, asins, MARKETPLACES[code]['domain']) for code in marketplaces}
+        return {code: future.result() for code, future in futures.items()}
+
+def price_in_marketplace(product_data, buy_price, marketplace):
+    # buy_price is in GBP; profit is worked out in the marketplace currency, then converted back
+    sell_price, sellers = extract_sell_price(product_data)
+    fba_fees = product_data.get("fbaFees") or {}
+    profit, roi = calculate_profits(from_gbp(buy_price, marketplace), sell_price, fba_fees, marketplace)
+    profit_margin = round((profit / sell_price) * 100, 2) if sell_price > 0 else 0.0
+    return {
+        'sell_price': sell_price,
+        'sellers': sellers,
+        'profit': profit,
+        'profit_gbp': to_gbp(profit, marketplace),
+        'roi': roi,
+        'profit_margin': profit_margin,
+    }
+
+def get_marketplace_view_worksheet(ws, rows, cols):
+    from gspread.exceptions import WorksheetNotFound
+    title = f"{ws.title}{MARKETPLACE_VIEW_SUFFIX}"
+    try:
+        return sheets_quota.call('read', ws.spreadsheet.worksheet, title)
+    except WorksheetNotFound:
+        return sheets_quota.call('write', ws.spreadsheet.add_worksheet, title, rows, cols)
+
+def update_marketplace_view(ws, marketplaces, stop_event=None):
+    # Price every ASIN in a tab on each marketplace and write the best-margin view in one pass
+    rows = sheets_quota.call('read', ws.get_all_values)[1:]  # Skip header
+    items = []
+    for idx, row in enumerate(rows, start=2):
+        if not row or not row[0].strip():
+            continue
+        try:
+            buy_price = float(row[2].replace("£", ""))
+        except (IndexError, ValueError):
+            print(f"Invalid buy price in row {idx}. Skipping.")
+            continue
+        items.append((row[0].split("/dp/")[-1].split("/")[0], buy_price))
+
+    view_rows = []
+    best_counts = {code: 0 for code in marketplaces}
+    for i in range(0, len(items), BATCH_SIZE):
+        if stop_event and stop_event.is_set():
+            break
+        batch = items[i:i + BATCH_SIZE]
+        send_discord_message(f"Progress: pricing {i + len(batch)}/{len(items)} ASINs from {ws.title} on {', '.join(marketplaces)}")
+        batch_data = fetch_keepa_data_multi([asin for asin, _ in batch], marketplaces)
+
+        for asin, buy_price in batch:
+            prices = {}
+            for code in marketplaces:
+                product_data = batch_data[code].get(asin)
+                if product_data:
+                    prices[code] = price_in_marketplace(product_data, buy_price, code)
+            margins = [prices[code]['profit_margin'] if code in prices else "" for code in marketplaces]
+            if prices:
+                best = max(prices, key=lambda code: prices[code]['profit_margin'])
+                best_counts[best] += 1
+                view_rows.append([asin, buy_price] + margins + [
+                    best,
+                    prices[best]['profit_margin'],
+                    format_price(prices[best]['sell_price'], best),
+                    format_price(prices[best]['profit'], best),
+                    prices[best]['profit_gbp'],
+                ])
+            else:
+                view_rows.append([asin, buy_price] + margins + ["", "", "", "", ""])
+
+    # Leave the previous view in place rather than replace it with a partial one
+    if stop_event and stop_event.is_set():
+        message = f"Marketplace view for {ws.title} stopped after {len(view_rows)} ASINs; existing view left unchanged"
+        print(f"\n🛑 {message}")
+        send_discord_message(message)
+        return {'sheet': ws.title, 'view': None, 'asins': len(view_rows), 'best_counts': best_counts}
+
+    header = ["ASIN", "Buy (£)"] + [f"{code} Margin %" for code in marketplaces] + [
+        "Best Marketplace", "Best Margin %", "Best Sell", "Best Profit", "Best Profit (£)"
+    ]
+    view = get_marketplace_view_worksheet(ws, len(view_rows) + 1, len(header))
+    sheets_quota.call('write', view.clear)
+    sheets_quota.call('write', view.update, "A1", [header] + view_rows)
+
+    summary = ", ".join(f"{code}: {count}" for code, count in best_counts.items())
+    message = f"Completed marketplace view for {ws.title} ({len(view_rows)} ASINs). Best marketplace counts: {summary}"
+    print(f"✅ {message}")
+    send_discord_message(message)
+    return {'sheet': ws.title, 'view': view.title, 'asins': len(view_rows), 'best_counts': best_counts}
+
 if __name__ == "__main__":
     update_all_sheets()
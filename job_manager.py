@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import threading
+import time as time_module
+
+ALL_SHEETS = "all"
+
+# Job kinds, each with its own runner
+UPDATE_JOB = "update"              # Profit update of 'all' or one tab
+MARKETPLACES_JOB = "marketplaces"  # Per-marketplace view of one tab, params={'marketplaces': [...]}
+
+class Subscription:
+    def __init__(self, channel_id, sheet, future):
+        self.channel_id = channel_id
+        self.sheet = sheet  # What this subscriber asked for ('all' or a tab name)
+        self.future = future
+
+class UpdateJob:
+    def __init__(self, job_id, sheet, kind=UPDATE_JOB, params=None):
+        self.id = job_id
+        self.sheet = sheet  # 'all' or a lower-cased tab name
+        self.kind = kind
+        self.params = params or {}  # Extra runner arguments, part of the single-flight key
+        self.status = "queued"
+        self.subscriptions = []
+        self.stop_event = threading.Event()
+        self.created_at = time_module.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = ""  # Latest status message from the runner
+
+    def covers(self, sheet, kind=UPDATE_JOB, params=None):
+        if kind != self.kind or (params or {}) != self.params:
+            return False
+        if kind == UPDATE_JOB and self.sheet == ALL_SHEETS:
+            return True
+        return self.sheet == sheet
+
+def filter_profit_items(profit_items, sheet):
+    # A subscriber to one tab only gets that tab's items from a merged run
+    if sheet == ALL_SHEETS:
+        return profit_items
+    return {
+        category: [item for item in items if item.get('sheet', '').lower() == sheet]
+        for category, items in profit_items.items()
+    }
+
+class JobManager:
+    def __init__(self, runners):
+        # runners maps a job kind to a coroutine runner(sheet, stop_event, on_progress, **params);
+        # the UPDATE_JOB runner returns profit_items
+        self.runners = runners
+        self.queue = []
+        self.current = None
+        self.history = []  # Recently finished jobs, newest last
+        self.ids = itertools.count(1)
+        self.wakeup = None
+        self.worker = None
+
+    def start(self):
+        if self.worker is None:
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+
+    def find_covering_job(self, sheet, kind=UPDATE_JOB, params=None):
+        # Single-flight: reuse the running or queued job that already covers this sheet
+        if self.current and self.current.covers(sheet, kind, params) and not self.current.stop_event.is_set():
+            return self.current
+        for job in self.queue:
+            if job.covers(sheet, kind, params):
+                return job
+        return None
+
+    def is_subscribed(self, channel_id, sheet, kind=UPDATE_JOB, params=None):
+        job = self.find_covering_job(sheet.lower(), kind, params)
+        return job is not None and any(sub.channel_id == channel_id for sub in job.subscriptions)
+
+    def submit(self, sheet, channel_id, kind=UPDATE_JOB, params=None):
+        # Returns (job, future, merged) where merged is True if an existing job was joined
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        sheet = sheet.lower()
+        future = asyncio.get_running_loop().create_future()
+        subscription = Subscription(channel_id, sheet, future)
+
+        job = self.find_covering_job(sheet, kind, params)
+        if job:
+            job.subscriptions.append(subscription)
+            return job, future, True
+
+        job = UpdateJob(next(self.ids), sheet, kind, params)
+        job.subscriptions.append(subscription)
+        if kind == UPDATE_JOB and sheet == ALL_SHEETS:
+            # A full run covers every queued single-sheet update, so fold them in
+            for queued in [j for j in self.queue if j.kind == UPDATE_JOB and j.sheet != ALL_SHEETS]:
+                job.subscriptions.extend(queued.subscriptions)
+                self.queue.remove(queued)
+        self.queue.append(job)
+        self.wakeup.set()
+        return job, future, False
+
+    def position(self, job):
+        if job is self.current:
+            return 0
+        return self.queue.index(job) + 1 if job in self.queue else None
+
+    def cancel_channel(self, channel_id):
+        # Drop this channel's subscriptions; stop jobs nobody is waiting on any more
+        cancelled = 0
+        jobs = ([self.current] if self.current else []) + list(self.queue)
+        for job in jobs:
+            remaining = []
+            for sub in job.subscriptions:
+                if sub.channel_id == channel_id:
+                    sub.future.cancel()
+                    cancelled += 1
+                else:
+                    remaining.append(sub)
+            job.subscriptions = remaining
+            if not remaining:
+                if job is self.current:
+                    job.stop_event.set()
+                    job.status = "stopping"
+                else:
+                    job.status = "cancelled"
+                    self.queue.remove(job)
+        return cancelled
+
+    def describe(self):
+        jobs = ([self.current] if self.current else []) + list(self.queue)
+        return [
+            {
+                'id': job.id,
+                'kind': job.kind,
+                'sheet': job.sheet,
+                'params': job.params,
+                'status': job.status,
+                'position': self.position(job),
+                'subscribers': len(job.subscriptions),
+                'progress': job.progress,
+                'waiting_seconds': int(time_module.time() - job.created_at),
+            }
+            for job in jobs
+        ]
+
+    def _progress_callback(self, job):
+        def on_progress(message, is_error=False):
+            job.progress = message
+        return on_progress
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            job = self.queue.pop(0)
+            self.current = job
+            job.status = "running"
+            job.started_at = time_module.time()
+            try:
+                runner = self.runners[job.kind]
+                result = await runner(job.sheet, job.stop_event, self._progress_callback(job), **job.params)
+            except Exception as e:
+                job.status = "failed"
+                for sub in job.subscriptions:
+                    if not sub.future.done():
+                        sub.future.set_exception(e)
+            else:
+                job.status = "stopped" if job.stop_event.is_set() else "done"
+                for sub in job.subscriptions:
+                    if not sub.future.done():
+                        sub.future.set_result(filter_profit_items(result, sub.sheet) if job.kind == UPDATE_JOB else result)
+            finally:
+                job.finished_at = time_module.time()
+                self.current = None
+                self.history = (self.history + [job])[-10:]
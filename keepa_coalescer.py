@@ -0,0 +1,69 @@
+import asyncio
+import re
+
+# Single-ASIN lookups arriving within this window are merged into one Keepa request
+COALESCE_WINDOW = 0.5  # seconds
+MAX_COALESCED_ASINS = 10  # Flush early once a batch is this big
+ASIN_PATTERN = re.compile(r"^[A-Z0-9]{10}$")
+
+def normalise_asin(asin):
+    # Anything else would be spliced into the comma-separated Keepa asin parameter as-is
+    asin = asin.strip().upper()
+    if not ASIN_PATTERN.match(asin):
+        raise ValueError(f"'{asin}' is not a valid ASIN (expected 10 letters or digits)")
+    return asin
+
+class KeepaCoalescer:
+    def __init__(self, fetch_batch, window=COALESCE_WINDOW, max_batch=MAX_COALESCED_ASINS):
+        # fetch_batch(asins) returns {asin: result}; it may be blocking or a coroutine
+        self.fetch_batch = fetch_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {}   # asin -> [futures] waiting for the next flush
+        self.inflight = {}  # asin -> [futures] waiting on a request already sent
+        self.flush_handle = None
+
+    async def lookup(self, asin):
+        asin = normalise_asin(asin)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        # Piggyback on a request that is already in flight for this ASIN
+        if asin in self.inflight:
+            self.inflight[asin].append(future)
+            return await future
+
+        self.pending.setdefault(asin, []).append(future)
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        self.inflight.update(batch)
+        asyncio.get_running_loop().create_task(self._fetch(list(batch)))
+
+    async def _fetch(self, asins):
+        print(f"Coalesced {len(asins)} lookups into one Keepa request: {', '.join(asins)}")
+        try:
+            if asyncio.iscoroutinefunction(self.fetch_batch):
+                results = await self.fetch_batch(asins)
+            else:
+                results = await asyncio.to_thread(self.fetch_batch, asins)
+        except Exception as e:
+            for asin in asins:
+                for future in self.inflight.pop(asin, []):
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for asin in asins:
+            for future in self.inflight.pop(asin, []):
+                if not future.done():
+                    future.set_result(results.get(asin))
@@ -0,0 +1,216 @@
+import hashlib
+import math
+import os
+import threading
+import time as time_module
+from state_snapshot import snapshot
+
+MAX_TOKENS = 1200
+QUARANTINE_SECONDS = 600       # How long a failing key is benched
+MAX_CONSECUTIVE_ERRORS = 3     # Transient errors before a key is quarantined
+KEY_ERROR_STATUS_CODES = (401, 402, 403)  # Invalid, unpaid or forbidden key
+
+# Offers requested per product. Keepa charges 1 token per ASIN plus 6 per page of 10 offers,
+# so a batch costs far more than len(asins)
+KEEPA_OFFERS = 40
+TOKENS_PER_ASIN = 1 + 6 * math.ceil(KEEPA_OFFERS / 10)
+
+def batch_cost(asin_count):
+    return asin_count * TOKENS_PER_ASIN
+
+# Token management
+class TokenManager:
+    def __init__(self):
+        self.tokens_left = MAX_TOKENS  # Start with max tokens
+        self.refill_time = 0
+        self.refill_rate = 20  # Tokens per minute
+        self.last_update = time_module.time()
+
+    def update_from_response(self, response):
+        self.tokens_left = response.get('tokensLeft', self.tokens_left)
+        # Keepa reports refillIn in milliseconds
+        self.refill_time = response.get('refillIn', 0) / 1000
+        self.refill_rate = response.get('refillRate', self.refill_rate)
+        self.last_update = time_module.time()
+
+    def has_tokens(self):
+        # Update tokens based on time passed
+        current_time = time_module.time()
+        time_passed = current_time - self.last_update
+        if time_passed > 0:
+            tokens_refilled = int(time_passed * (self.refill_rate / 60))
+            if tokens_refilled > 0:
+                self.tokens_left = min(MAX_TOKENS, self.tokens_left + tokens_refilled)
+                self.last_update = current_time
+
+        return self.tokens_left > 0
+
+    def seconds_until_tokens(self):
+        if self.tokens_left > 0:
+            return 0
+        if self.refill_time > 0:
+            return self.refill_time
+        return 60
+
+    def wait_for_tokens(self):
+        if self.tokens_left <= 0:
+            wait_time = self.seconds_until_tokens()
+            print(f"⏳ Waiting {wait_time} seconds for token refill...")
+            time_module.sleep(wait_time)
+            return True
+        return False
+
+    def to_dict(self):
+        return {
+            'tokens_left': self.tokens_left,
+            'refill_time': self.refill_time,
+            'refill_rate': self.refill_rate,
+            'last_update': self.last_update,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        manager = cls()
+        manager.tokens_left = data.get('tokens_left', manager.tokens_left)
+        manager.refill_time = data.get('refill_time', manager.refill_time)
+        manager.refill_rate = data.get('refill_rate', manager.refill_rate)
+        manager.last_update = data.get('last_update', manager.last_update)
+        return manager
+
+def key_fingerprint(key):
+    # Keys are never written to disk; state is stored under a short hash
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+class KeepaKey:
+    def __init__(self, key):
+        self.key = key
+        self.fingerprint = key_fingerprint(key)
+        self.tokens = TokenManager()
+        self.quarantined_until = 0
+        self.consecutive_errors = 0
+        self.last_error = ""
+        self.known = False  # True once the bucket reflects a real Keepa response
+
+    def is_available(self, now):
+        return now >= self.quarantined_until
+
+class KeepaKeyPool:
+    def __init__(self, keys):
+        self.keys = [KeepaKey(key) for key in dict.fromkeys(keys)]
+        self.lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def from_env(cls):
+        # KEEPA_API_KEYS is a comma-separated list; KEEPA_API_KEY still works on its own
+        keys = [key.strip() for key in os.getenv('KEEPA_API_KEYS', '').split(',') if key.strip()]
+        if not keys and os.getenv('KEEPA_API_KEY'):
+            keys = [os.getenv('KEEPA_API_KEY')]
+        return cls(keys)
+
+    def acquire(self, cost):
+        # Pick the available key with the most tokens and reserve the expected cost,
+        # so concurrent batches spread across keys. Returns None if every key is dry.
+        with self.lock:
+            now = time_module.time()
+            candidates = [k for k in self.keys if k.is_available(now) and k.tokens.has_tokens()]
+            if not candidates:
+                return None
+            best = max(candidates, key=lambda k: k.tokens.tokens_left)
+            best.tokens.tokens_left -= cost
+            return best
+
+    def record_response(self, keepa_key, response):
+        with self.lock:
+            keepa_key.tokens.update_from_response(response)
+            keepa_key.consecutive_errors = 0
+            keepa_key.known = True
+            self.save()
+
+    def record_error(self, keepa_key, error, fatal=False):
+        with self.lock:
+            keepa_key.consecutive_errors += 1
+            keepa_key.last_error = str(error)
+            if fatal or keepa_key.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                keepa_key.quarantined_until = time_module.time() + QUARANTINE_SECONDS
+                keepa_key.consecutive_errors = 0
+                # Its balance is unknown now: empty the bucket (no refill accrues while benched)
+                # and re-probe /token once the quarantine ends
+                keepa_key.tokens.tokens_left = 0
+                keepa_key.tokens.last_update = keepa_key.quarantined_until
+                keepa_key.known = False
+                print(f"🚫 Keepa key {keepa_key.fingerprint} quarantined for {QUARANTINE_SECONDS} seconds: {error}")
+            self.save()
+
+    def unknown_keys(self):
+        # Keys whose balance needs a /token probe, skipping any still in quarantine
+        with self.lock:
+            now = time_module.time()
+            return [k for k in self.keys if not k.known and k.is_available(now)]
+
+    def seconds_until_available(self):
+        with self.lock:
+            now = time_module.time()
+            waits = []
+            for k in self.keys:
+                if not k.is_available(now):
+                    waits.append(k.quarantined_until - now)
+                elif k.tokens.has_tokens():
+                    return 0
+                else:
+                    waits.append(k.tokens.seconds_until_tokens())
+            return min(waits) if waits else 60
+
+    def has_tokens(self):
+        return self.seconds_until_available() == 0
+
+    def wait_for_tokens(self):
+        if not self.keys:
+            return False
+        wait_time = self.seconds_until_available()
+        if wait_time > 0:
+            print(f"⏳ Waiting {wait_time:.0f} seconds for token refill...")
+            time_module.sleep(wait_time)
+            return True
+        return False
+
+    def status(self):
+        with self.lock:
+            now = time_module.time()
+            return [
+                {
+                    'key': k.fingerprint,
+                    'tokens_left': k.tokens.tokens_left,
+                    'refill_rate': k.tokens.refill_rate,
+                    'quarantined_for': max(0, int(k.quarantined_until - now)),
+                    'last_error': k.last_error,
+                }
+                for k in self.keys
+            ]
+
+    def to_dict(self):
+        return {
+            k.fingerprint: {
+                'tokens': k.tokens.to_dict(),
+                'quarantined_until': k.quarantined_until,
+                'last_error': k.last_error,
+                'known': k.known,
+            }
+            for k in self.keys
+        }
+
+    def restore(self, state):
+        for k in self.keys:
+            saved = state.get(k.fingerprint)
+            if not saved:
+                continue
+            k.tokens = TokenManager.from_dict(saved.get('tokens', {}))
+            k.quarantined_until = saved.get('quarantined_until', 0)
+            k.last_error = saved.get('last_error', "")
+            k.known = saved.get('known', True)
+
+    def save(self):
+        snapshot.set('keepa_keys', self.to_dict())
+
+    def load(self):
+        self.restore(snapshot.get('keepa_keys', {}))
@@ -0,0 +1,55 @@
+import json
+import os
+
+# Per-marketplace Keepa domain, currency and fee rates (as a share of the gross sell price).
+# vat_rate is the VAT portion of a VAT-inclusive price: UK keeps the historical 16%,
+# the others are rate / (1 + rate).
+MARKETPLACES = {
+    'UK': {'domain': 2, 'currency': 'GBP', 'symbol': '£', 'referral_rate': 0.15, 'vat_rate': 0.16},
+    'DE': {'domain': 3, 'currency': 'EUR', 'symbol': '€', 'referral_rate': 0.15, 'vat_rate': 0.16},   # 19%
+    'FR': {'domain': 4, 'currency': 'EUR', 'symbol': '€', 'referral_rate': 0.15, 'vat_rate': 0.167},  # 20%
+    'IT': {'domain': 8, 'currency': 'EUR', 'symbol': '€', 'referral_rate': 0.15, 'vat_rate': 0.18},   # 22%
+    'ES': {'domain': 9, 'currency': 'EUR', 'symbol': '€', 'referral_rate': 0.15, 'vat_rate': 0.174},  # 21%
+}
+DEFAULT_MARKETPLACE = 'UK'
+
+# Conversion into GBP, the currency buy prices are entered in.
+# Override with e.g. FX_RATES_TO_GBP='{"EUR": 0.86}'
+FX_RATES_TO_GBP = {'GBP': 1.0, 'EUR': 0.85}
+FX_RATES_TO_GBP.update(json.loads(os.getenv('FX_RATES_TO_GBP', '{}')))
+
+def get_marketplace(code):
+    try:
+        return MARKETPLACES[code.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown marketplace '{code}'. Choose from: {', '.join(MARKETPLACES)}")
+
+def parse_marketplaces(codes):
+    # "uk, de,FR" -> ['UK', 'DE', 'FR'], validated and de-duplicated
+    parsed = []
+    for code in codes.split(',') if isinstance(codes, str) else codes:
+        code = code.strip().upper()
+        if not code:
+            continue
+        get_marketplace(code)
+        if code not in parsed:
+            parsed.append(code)
+    return parsed
+
+def to_gbp(amount, code):
+    return round(amount * FX_RATES_TO_GBP[get_marketplace(code)['currency']], 2)
+
+def from_gbp(amount, code):
+    return round(amount / FX_RATES_TO_GBP[get_marketplace(code)['currency']], 2)
+
+def format_price(amount, code):
+    return f"{get_marketplace(code)['symbol']}{amount:.2f}"
+
+def calculate_profit(buy_price, sell_price, fba_fee, code=DEFAULT_MARKETPLACE):
+    # Per-unit profit and ROI %; all amounts, including fba_fee, are in the marketplace's own currency
+    fees = get_marketplace(code)
+    referral_fee = round(sell_price * fees['referral_rate'], 2)
+    vat_fee = round(sell_price * fees['vat_rate'], 2)
+    profit_per_unit = round(sell_price - referral_fee - fba_fee - buy_price - vat_fee, 2)
+    roi = round((profit_per_unit / buy_price) * 100, 2) if buy_price > 0 else 0
+    return profit_per_unit, roi
@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from job_manager import ALL_SHEETS
+
+# Runs the pricing engine (Keepa fetches, offer processing, Sheets writes) in a separate
+# process so the bot's event loop and gateway heartbeat never share a GIL with it.
+#
+# Protocol: plain dicts over two multiprocessing queues.
+#   bot -> worker: {'type': 'run', 'job_id', 'sheet'}      full update of 'all' or one tab
+#                  {'type': 'price', 'job_id', 'asins'}    Keepa batch lookup, priced into plain numbers
+#                  {'type': 'marketplaces', 'job_id', 'sheet', 'marketplaces'}
+#                                                          per-marketplace best-margin view of one tab
+#                  {'type': 'cancel', 'job_id'}            stop a run between batches
+#                  {'type': 'shutdown'}
+#   worker -> bot: {'type': 'progress', 'job_id', 'message', 'is_error'}
+#                  {'type': 'result', 'job_id', 'result'}
+#                  {'type': 'error', 'job_id', 'error', 'error_type'}
+
+WORKER_POLL_INTERVAL = 1  # Seconds between liveness/cancellation checks
+
+def find_source_worksheet(sheet):
+    # Generated marketplace views aren't source tabs: updating one would overwrite its margins
+    from gsheets import get_all_worksheets, is_marketplace_view
+    for ws in get_all_worksheets():
+        if ws.title.lower() == sheet.lower():
+            if is_marketplace_view(ws.title):
+                raise LookupError(f"Sheet '{ws.title}' is a generated marketplace view, not a source tab.")
+            return ws
+    raise LookupError(f"Sheet '{sheet}' not found.")
+
+def run_update(sheet, stop_event):
+    from gsheets import update_all_sheets, update_sheet
+    if sheet == ALL_SHEETS:
+        return update_all_sheets(stop_event)
+    return update_sheet(find_source_worksheet(sheet), stop_event)
+
+def run_marketplace_view(sheet, marketplaces, stop_event):
+    from gsheets import update_marketplace_view
+    return update_marketplace_view(find_source_worksheet(sheet), marketplaces, stop_event)
+
+def worker_main(requests_queue, events_queue):
+    import gsheets
+
+    stop_events = {}
+    current_job = threading.local()
+
+    def report_progress(message, is_error):
+        job_id = getattr(current_job, 'job_id', None)
+        if job_id is not None:
+            events_queue.put({'type': 'progress', 'job_id': job_id, 'message': message, 'is_error': is_error})
+
+    gsheets.progress_hook = report_progress
+
+    def handle(request):
+        job_id = request['job_id']
+        current_job.job_id = job_id
+        try:
+            if request['type'] == 'run':
+                result = run_update(request['sheet'], stop_events[job_id])
+            elif request['type'] == 'marketplaces':
+                result = run_marketplace_view(request['sheet'], request['marketplaces'], stop_events[job_id])
+            else:
+                result = gsheets.price_products(request['asins'])
+            events_queue.put({'type': 'result', 'job_id': job_id, 'result': result})
+        except Exception as e:
+            events_queue.put({'type': 'error', 'job_id': job_id, 'error': str(e), 'error_type': type(e).__name__})
+        finally:
+            current_job.job_id = None
+            stop_events.pop(job_id, None)
+
+    # Update runs are serialised; lookups get their own threads so /price isn't stuck behind a run
+    runs = ThreadPoolExecutor(max_workers=1)
+    lookups = ThreadPoolExecutor(max_workers=2)
+    while True:
+        request = requests_queue.get()
+        if request['type'] == 'shutdown':
+            break
+        if request['type'] == 'cancel':
+            if request['job_id'] in stop_events:
+                stop_events[request['job_id']].set()
+            continue
+        stop_events[request['job_id']] = threading.Event()
+        (lookups if request['type'] == 'price' else runs).submit(handle, request)
+
+    for event in stop_events.values():
+        event.set()
+    runs.shutdown(wait=True)
+    lookups.shutdown(wait=True)
+
+class WorkerError(Exception):
+    pass
+
+class PricingWorker:
+    def __init__(self):
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.requests_queue = None
+        self.events_queue = None
+        self.pending = {}  # job_id -> asyncio future
+        self.progress_callbacks = {}  # job_id -> on_progress(message, is_error), called on the event loop
+        self.ids = itertools.count(1)
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._spawn()
+
+    def _spawn(self):
+        self.requests_queue = self.context.Queue()
+        self.events_queue = self.context.Queue()
+        self.process = self.context.Process(target=worker_main, args=(self.requests_queue, self.events_queue), daemon=True)
+        self.process.start()
+        threading.Thread(target=self._read_events, args=(self.process, self.events_queue), daemon=True).start()
+        print(f"Started pricing worker (pid {self.process.pid})")
+
+    def _read_events(self, process, events_queue):
+        # Runs in a thread: hands worker events to the event loop, fails jobs if the worker dies
+        while True:
+            try:
+                event = events_queue.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive():
+                    self.loop.call_soon_threadsafe(self._fail_all, f"Pricing worker exited with code {process.exitcode}")
+                    return
+                continue
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        job_id = event['job_id']
+        if event['type'] == 'progress':
+            on_progress = self.progress_callbacks.get(job_id)
+            if on_progress:
+                on_progress(event['message'], event['is_error'])
+            return
+        self.progress_callbacks.pop(job_id, None)
+        future = self.pending.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if event['type'] == 'result':
+            future.set_result(event['result'])
+        elif event['error_type'] == 'LookupError':
+            future.set_exception(LookupError(event['error']))
+        else:
+            future.set_exception(WorkerError(event['error']))
+
+    def _fail_all(self, reason):
+        pending, self.pending = self.pending, {}
+        self.progress_callbacks = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(WorkerError(reason))
+
+    def _submit(self, request):
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self._spawn()
+        job_id = next(self.ids)
+        future = self.loop.create_future()
+        self.pending[job_id] = future
+        self.requests_queue.put(dict(request, job_id=job_id))
+        return job_id, future
+
+    async def run(self, sheet, stop_event, on_progress=None):
+        # JobManager runner: returns profit_items, stops between batches once stop_event is set
+        return await self._run_job({'type': 'run', 'sheet': sheet}, stop_event, on_progress)
+
+    async def marketplace_view(self, sheet, stop_event, on_progress=None, marketplaces=()):
+        # JobManager runner for MARKETPLACES_JOB: returns the view summary
+        return await self._run_job({'type': 'marketplaces', 'sheet': sheet, 'marketplaces': list(marketplaces)}, stop_event, on_progress)
+
+    async def _run_job(self, request, stop_event, on_progress):
+        job_id, future = self._submit(request)
+        if on_progress:
+            self.progress_callbacks[job_id] = on_progress
+        cancelled = False
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=WORKER_POLL_INTERVAL)
+            if done:
+                return future.result()
+            if stop_event.is_set() and not cancelled:
+                self.requests_queue.put({'type': 'cancel', 'job_id': job_id})
+                cancelled = True
+
+    async def price(self, asins):
+        # {asin: {'asin', 'title', 'sell_price', 'sellers', 'spm', 'fba_fee'} or None}
+        _, future = self._submit({'type': 'price', 'asins': list(asins)})
+        return await future
+
+    def shutdown(self):
+        if self.process and self.process.is_alive():
+            self.requests_queue.put({'type': 'shutdown'})
+            self.process.join(timeout=10)
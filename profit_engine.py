@@ -0,0 +1,76 @@
+import numpy as np
+from marketplaces import MARKETPLACES, DEFAULT_MARKETPLACE
+from results_db import results_store
+
+# Vectorised version of calculate_profits for what-if sweeps over whole tabs.
+# Sweeps broadcast to arrays shaped (asins, buy grid, sell grid, fee schedules).
+
+# Same default (UK) rates as gsheets.calculate_profits, without importing the Sheets/Keepa engine
+REFERRAL_FEE_RATE = MARKETPLACES[DEFAULT_MARKETPLACE]['referral_rate']
+VAT_RATE = MARKETPLACES[DEFAULT_MARKETPLACE]['vat_rate']
+DEFAULT_FEE_SCHEDULE = (REFERRAL_FEE_RATE, VAT_RATE)
+
+def load_tab(sheet):
+    # Latest stored rows for a tab, reusing the FBA fees cached from the last Keepa run
+    rows = [r for r in results_store.for_sheet(sheet) if r['sell_price'] and r['sell_price'] > 0]
+    return {
+        'asins': [r['asin'] for r in rows],
+        'buy_prices': np.array([r['buy_price'] or 0.0 for r in rows], dtype=float),
+        'sell_prices': np.array([r['sell_price'] for r in rows], dtype=float),
+        'fba_fees': np.array([r['fba_fee'] or 0.0 for r in rows], dtype=float),
+    }
+
+def sweep(buy_prices, sell_prices, fba_fees, buy_multipliers=(1.0,), sell_multipliers=(1.0,), fee_schedules=(DEFAULT_FEE_SCHEDULE,)):
+    buy_prices = np.asarray(buy_prices, dtype=float)[:, None, None, None]
+    sell_prices = np.asarray(sell_prices, dtype=float)[:, None, None, None]
+    fba_fees = np.asarray(fba_fees, dtype=float)[:, None, None, None]
+    schedules = np.asarray(fee_schedules, dtype=float)
+    referral_rates = schedules[:, 0][None, None, None, :]
+    vat_rates = schedules[:, 1][None, None, None, :]
+
+    buy = buy_prices * np.asarray(buy_multipliers, dtype=float)[None, :, None, None]
+    sell = sell_prices * np.asarray(sell_multipliers, dtype=float)[None, None, :, None]
+    profit = np.round(sell * (1 - referral_rates - vat_rates) - fba_fees - buy, 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi = np.where(buy > 0, np.round(profit / buy * 100, 2), 0.0)
+        margin = np.where(sell > 0, np.round(profit / sell * 100, 2), 0.0)
+    return {'buy': buy, 'sell': sell, 'profit': profit, 'roi': roi, 'margin': margin}
+
+def max_buy_price(sell_prices, fba_fees, target_margin=0.0, referral_rate=REFERRAL_FEE_RATE, vat_rate=VAT_RATE):
+    # Highest buy price that still leaves target_margin (as a fraction of the sell price).
+    # With target_margin=0 this is the break-even buy price.
+    sell_prices = np.asarray(sell_prices, dtype=float)
+    fba_fees = np.asarray(fba_fees, dtype=float)
+    return np.round(sell_prices * (1 - referral_rate - vat_rate - target_margin) - fba_fees, 2)
+
+def what_if(sheet, target_margin=15.0, sell_change=0.0, referral_rate=REFERRAL_FEE_RATE, vat_rate=VAT_RATE):
+    # Per-ASIN view of a tab at a shifted sell price (sell_change in %, e.g. -10)
+    tab = load_tab(sheet)
+    if not tab['asins']:
+        return []
+    sell_multiplier = 1 + sell_change / 100
+    result = sweep(
+        tab['buy_prices'], tab['sell_prices'], tab['fba_fees'],
+        sell_multipliers=(sell_multiplier,), fee_schedules=((referral_rate, vat_rate),)
+    )
+    sell = tab['sell_prices'] * sell_multiplier
+    break_even = max_buy_price(sell, tab['fba_fees'], 0.0, referral_rate, vat_rate)
+    target_buy = max_buy_price(sell, tab['fba_fees'], target_margin / 100, referral_rate, vat_rate)
+
+    rows = []
+    for i, asin in enumerate(tab['asins']):
+        rows.append({
+            'asin': asin,
+            'buy_price': float(tab['buy_prices'][i]),
+            'sell_price': round(float(sell[i]), 2),
+            'profit': float(result['profit'][i, 0, 0, 0]),
+            'margin': float(result['margin'][i, 0, 0, 0]),
+            'roi': float(result['roi'][i, 0, 0, 0]),
+            'break_even_buy': float(break_even[i]),
+            'target_buy': float(target_buy[i]),
+            'headroom': round(float(target_buy[i] - tab['buy_prices'][i]), 2),
+        })
+    # Best opportunities (most room under the target-margin buy price) first
+    rows.sort(key=lambda r: r['headroom'], reverse=True)
+    return rows
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import time as time_module
+
+# Local store of every computed row, so questions like "top 20 by ROI" don't need Sheets or Keepa
+RESULTS_DB_FILE = os.getenv('RESULTS_DB_FILE', "results.db")
+
+# Sortable columns exposed to /top, mapped to their SQL column
+SORT_COLUMNS = {
+    'roi': 'roi',
+    'margin': 'margin',
+    'profit': 'profit',
+    'spm': 'spm',
+    'updated': 'updated_at',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    asin TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    row INTEGER,
+    brand TEXT,
+    buy_price REAL,
+    sell_price REAL,
+    profit REAL,
+    roi REAL,
+    margin REAL,
+    spm INTEGER,
+    sellers INTEGER,
+    fba_fee REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sheet, asin)
+);
+CREATE INDEX IF NOT EXISTS idx_results_roi ON results (roi);
+CREATE INDEX IF NOT EXISTS idx_results_margin ON results (margin);
+CREATE INDEX IF NOT EXISTS idx_results_profit ON results (profit);
+CREATE INDEX IF NOT EXISTS idx_results_spm ON results (spm);
+CREATE INDEX IF NOT EXISTS idx_results_updated_at ON results (updated_at);
+CREATE INDEX IF NOT EXISTS idx_results_asin ON results (asin);
+"""
+
+RESULT_FIELDS = ['asin', 'sheet', 'row', 'brand', 'buy_price', 'sell_price', 'profit', 'roi', 'margin', 'spm', 'sellers', 'fba_fee', 'updated_at']
+
+class ResultsStore:
+    def __init__(self, path=RESULTS_DB_FILE):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A connection per call keeps the store safe to use from worker threads
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, results):
+        # Upsert the latest computation for each (sheet, ASIN)
+        if not results:
+            return
+        now = time_module.time()
+        rows = [tuple(result.get(field, now if field == 'updated_at' else None) for field in RESULT_FIELDS) for result in results]
+        placeholders = ", ".join("?" for _ in RESULT_FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in RESULT_FIELDS if field not in ('sheet', 'asin'))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO results ({', '.join(RESULT_FIELDS)}) VALUES ({placeholders}) "
+                    f"ON CONFLICT (sheet, asin) DO UPDATE SET {updates}",
+                    rows
+                )
+        finally:
+            conn.close()
+
+    def prune(self, sheet, before):
+        # Drop a tab's rows that a completed pass started at `before` didn't touch
+        # (ASINs removed from the sheet or no longer priced)
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute("DELETE FROM results WHERE sheet = ? COLLATE NOCASE AND updated_at < ?", (sheet, before))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def top(self, sort='roi', limit=20, sheet=None, min_spm=None, min_roi=None, min_margin=None, max_buy_price=None,
+            max_age_hours=None):
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort '{sort}'. Choose from: {', '.join(SORT_COLUMNS)}")
+        clauses = []
+        params = []
+        if sheet:
+            clauses.append("sheet = ? COLLATE NOCASE")
+            params.append(sheet)
+        if min_spm is not None:
+            clauses.append("spm >= ?")
+            params.append(min_spm)
+        if min_roi is not None:
+            clauses.append("roi >= ?")
+            params.append(min_roi)
+        if min_margin is not None:
+            clauses.append("margin >= ?")
+            params.append(min_margin)
+        if max_buy_price is not None:
+            clauses.append("buy_price <= ?")
+            params.append(max_buy_price)
+        if max_age_hours is not None:
+            clauses.append("updated_at >= ?")
+            params.append(time_module.time() - max_age_hours * 3600)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT * FROM results {where} ORDER BY {SORT_COLUMNS[sort]} DESC LIMIT ?",
+                params
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def for_sheet(self, sheet):
+        conn = self._connect()
+        try:
+            cursor = conn.execute("SELECT * FROM results WHERE sheet = ? COLLATE NOCASE ORDER BY row", (sheet,))
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+results_store = ResultsStore()
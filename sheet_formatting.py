@@ -0,0 +1,160 @@
+from sheets_quota import sheets_quota
+
+# Columns D:I written by update_sheet, keyed by zero-based column index
+CURRENCY_FORMAT = {'type': 'CURRENCY', 'pattern': '"£"#,##0.00'}
+PERCENT_FORMAT = {'type': 'NUMBER', 'pattern': '0.00"%"'}
+INTEGER_FORMAT = {'type': 'NUMBER', 'pattern': '0'}
+COLUMN_FORMATS = {
+    3: CURRENCY_FORMAT,  # D - Sell price
+    4: PERCENT_FORMAT,   # E - ROI
+    5: CURRENCY_FORMAT,  # F - Profit
+    6: INTEGER_FORMAT,   # G - SPM
+    7: INTEGER_FORMAT,   # H - Sellers
+    8: PERCENT_FORMAT,   # I - Profit margin
+}
+FIRST_FORMAT_COLUMN = min(COLUMN_FORMATS)
+LAST_FORMAT_COLUMN = max(COLUMN_FORMATS)
+
+# Conditional formatting on column I (profit margin). Sheets applies the first
+# matching rule, so the highest threshold has to come first.
+MARGIN_COLUMN = 8
+MARGIN_RULES = [
+    ('100', {'red': 0.7, 'green': 1.0, 'blue': 0.7}),  # Green
+    ('50', {'red': 0.7, 'green': 0.9, 'blue': 1.0}),   # Light Blue
+    ('30', {'red': 1.0, 'green': 1.0, 'blue': 0.0}),   # Yellow
+]
+
+def column_letter(index):
+    return chr(ord('A') + index)
+
+def quote_sheet_title(title):
+    # A1 notation wraps tab names in quotes and doubles any quote inside them
+    return "'" + title.replace("'", "''") + "'"
+
+def build_margin_rules(sheet_id):
+    # Open-ended row range so the rules don't change as rows are added
+    rules = []
+    for threshold, color in MARGIN_RULES:
+        rules.append({
+            'ranges': [{'sheetId': sheet_id, 'startRowIndex': 1, 'startColumnIndex': MARGIN_COLUMN, 'endColumnIndex': MARGIN_COLUMN + 1}],
+            'booleanRule': {
+                'condition': {'type': 'NUMBER_GREATER', 'values': [{'userEnteredValue': threshold}]},
+                'format': {'backgroundColor': color}
+            }
+        })
+    return rules
+
+def _rule_key(rule):
+    # The API drops zero-valued fields and may echo extra ones, so compare a normalised view
+    ranges = tuple(
+        (r.get('startRowIndex', 0), r.get('endRowIndex'), r.get('startColumnIndex', 0), r.get('endColumnIndex'))
+        for r in rule.get('ranges', [])
+    )
+    boolean_rule = rule.get('booleanRule')
+    if not boolean_rule:
+        return ('gradient', ranges)
+    condition = boolean_rule.get('condition', {})
+    values = tuple(v.get('userEnteredValue') for v in condition.get('values', []))
+    color = boolean_rule.get('format', {}).get('backgroundColor', {})
+    color_key = tuple(round(color.get(c, 0.0), 2) for c in ('red', 'green', 'blue'))
+    return ('boolean', ranges, condition.get('type'), values, color_key)
+
+def _is_margin_rule(rule):
+    # Rules this module owns: boolean NUMBER_GREATER rules that only target column I
+    boolean_rule = rule.get('booleanRule')
+    if not boolean_rule or boolean_rule.get('condition', {}).get('type') != 'NUMBER_GREATER':
+        return False
+    ranges = rule.get('ranges', [])
+    return bool(ranges) and all(
+        r.get('startColumnIndex') == MARGIN_COLUMN and r.get('endColumnIndex') == MARGIN_COLUMN + 1
+        for r in ranges
+    )
+
+def _format_key(number_format):
+    if not number_format:
+        return None
+    return (number_format.get('type'), number_format.get('pattern', ''))
+
+class SheetFormatter:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        # sheetId -> {'rules': [...], 'formats': {column: numberFormat}}
+        self.state = {}
+
+    def load(self, worksheets):
+        # One metadata read covering the rules and the D2:I2 number formats of every tab
+        missing = [ws for ws in worksheets if ws.id not in self.state]
+        if not missing:
+            return
+        params = {
+            'ranges': [f"{quote_sheet_title(ws.title)}!{column_letter(FIRST_FORMAT_COLUMN)}2:{column_letter(LAST_FORMAT_COLUMN)}2" for ws in missing],
+            'includeGridData': True,
+            'fields': 'sheets(properties.sheetId,conditionalFormats,data(startColumn,rowData.values.userEnteredFormat.numberFormat))',
+        }
+        metadata = sheets_quota.call('read', self.spreadsheet.fetch_sheet_metadata, params)
+        for sheet in metadata.get('sheets', []):
+            sheet_id = sheet['properties']['sheetId']
+            formats = {}
+            for grid in sheet.get('data', []):
+                start_column = grid.get('startColumn', 0)
+                row_data = grid.get('rowData') or [{}]
+                for offset, cell in enumerate(row_data[0].get('values', [])):
+                    number_format = (cell.get('userEnteredFormat') or {}).get('numberFormat')
+                    if number_format:
+                        formats[start_column + offset] = number_format
+            self.state[sheet_id] = {
+                'rules': sheet.get('conditionalFormats', []),
+                'formats': formats,
+            }
+
+    def diff(self, ws):
+        state = self.state.get(ws.id, {'rules': [], 'formats': {}})
+        requests = []
+
+        # Conditional formatting: leave the tab alone when our rules are already in place
+        existing = state['rules']
+        desired = build_margin_rules(ws.id)
+        managed = [(index, rule) for index, rule in enumerate(existing) if _is_margin_rule(rule)]
+        if [_rule_key(rule) for _, rule in managed] != [_rule_key(rule) for rule in desired]:
+            # Delete from the highest index down so earlier indices stay valid
+            for index, _ in reversed(managed):
+                requests.append({'deleteConditionalFormatRule': {'sheetId': ws.id, 'index': index}})
+            for index, rule in enumerate(desired):
+                requests.append({'addConditionalFormatRule': {'rule': rule, 'index': index}})
+
+        # Number formats: set once per column, from row 2 down
+        for column, number_format in COLUMN_FORMATS.items():
+            if _format_key(state['formats'].get(column)) == _format_key(number_format):
+                continue
+            requests.append({
+                'repeatCell': {
+                    'range': {'sheetId': ws.id, 'startRowIndex': 1, 'startColumnIndex': column, 'endColumnIndex': column + 1},
+                    'cell': {'userEnteredFormat': {'numberFormat': number_format}},
+                    'fields': 'userEnteredFormat.numberFormat',
+                }
+            })
+        return requests
+
+    def sync(self, ws):
+        self.load([ws])
+        requests = self.diff(ws)
+        if not requests:
+            return False
+        sheets_quota.call('write', self.spreadsheet.batch_update, {'requests': requests})
+        # Record what the tab looks like now so later syncs in this process are no-ops
+        untouched = [rule for rule in self.state.get(ws.id, {}).get('rules', []) if not _is_margin_rule(rule)]
+        self.state[ws.id] = {
+            'rules': build_margin_rules(ws.id) + untouched,
+            'formats': dict(COLUMN_FORMATS),
+        }
+        return True
+
+# One formatter per spreadsheet so metadata is read once per process
+_formatters = {}
+
+def get_sheet_formatter(spreadsheet):
+    formatter = _formatters.get(spreadsheet.id)
+    if formatter is None:
+        formatter = SheetFormatter(spreadsheet)
+        _formatters[spreadsheet.id] = formatter
+    return formatter
@@ -0,0 +1,113 @@
+import threading
+import time as time_module
+from collections import deque
+
+# Google Sheets per-user quotas (requests per minute), tracked separately
+SHEETS_READ_QUOTA_PER_MINUTE = 60
+SHEETS_WRITE_QUOTA_PER_MINUTE = 60
+QUOTA_WINDOW = 60  # seconds
+
+# AIMD tuning
+ADDITIVE_INCREASE = 1          # Calls/minute regained per successful call
+MULTIPLICATIVE_DECREASE = 0.5  # Limit multiplier applied on a 429
+MIN_CALLS_PER_MINUTE = 5
+DEFAULT_BACKOFF = 30           # Seconds to back off when no Retry-After is given
+MAX_ATTEMPTS = 4
+
+def is_rate_limit_error(error):
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    return 'RESOURCE_EXHAUSTED' in str(error) or 'Quota exceeded' in str(error)
+
+def retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+class QuotaBucket:
+    def __init__(self, name, quota):
+        self.name = name
+        self.quota = quota
+        self.limit = float(quota)  # Current AIMD limit, calls per window
+        self.calls = deque()       # Timestamps of calls in the current window
+        self.blocked_until = 0
+
+    def _prune(self, now):
+        while self.calls and now - self.calls[0] >= QUOTA_WINDOW:
+            self.calls.popleft()
+
+    def wait_time(self, now):
+        # Seconds until another call fits under the current limit
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._prune(now)
+        if len(self.calls) < int(self.limit):
+            return 0
+        return self.calls[0] + QUOTA_WINDOW - now
+
+class SheetsQuotaController:
+    def __init__(self, read_quota=SHEETS_READ_QUOTA_PER_MINUTE, write_quota=SHEETS_WRITE_QUOTA_PER_MINUTE):
+        self.buckets = {
+            'read': QuotaBucket('read', read_quota),
+            'write': QuotaBucket('write', write_quota),
+        }
+        self.lock = threading.Lock()
+
+    def acquire(self, kind):
+        bucket = self.buckets[kind]
+        while True:
+            with self.lock:
+                now = time_module.time()
+                wait = bucket.wait_time(now)
+                if wait <= 0:
+                    bucket.calls.append(now)
+                    return
+            time_module.sleep(wait)
+
+    def on_success(self, kind):
+        bucket = self.buckets[kind]
+        with self.lock:
+            bucket.limit = min(bucket.quota, bucket.limit + ADDITIVE_INCREASE)
+
+    def on_throttle(self, kind, retry_after=None):
+        bucket = self.buckets[kind]
+        with self.lock:
+            bucket.limit = max(MIN_CALLS_PER_MINUTE, bucket.limit * MULTIPLICATIVE_DECREASE)
+            backoff = retry_after if retry_after is not None else DEFAULT_BACKOFF
+            bucket.blocked_until = max(bucket.blocked_until, time_module.time() + backoff)
+        print(f"⏳ Google Sheets {kind} quota hit. Limit now {int(bucket.limit)}/min, backing off {backoff:.0f} seconds...")
+
+    def call(self, kind, fn, *args, **kwargs):
+        # Run a Sheets call under the quota, retrying 429s after backing off
+        attempt = 0
+        while True:
+            self.acquire(kind)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not is_rate_limit_error(e) or attempt >= MAX_ATTEMPTS:
+                    raise
+                self.on_throttle(kind, retry_after_seconds(e))
+                continue
+            self.on_success(kind)
+            return result
+
+    def status(self):
+        with self.lock:
+            now = time_module.time()
+            return {
+                kind: {
+                    'limit': int(bucket.limit),
+                    'used': len([t for t in bucket.calls if now - t < QUOTA_WINDOW]),
+                    'blocked_for': max(0, round(bucket.blocked_until - now, 1)),
+                }
+                for kind, bucket in self.buckets.items()
+            }
+
+# Shared controller for every Sheets call in the process
+sheets_quota = SheetsQuotaController()
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+# Runtime state that should survive a restart or redeploy: Keepa token buckets,
+# the spreadsheet ID, the in-flight checkpoint and the command tree hash.
+# Point STATE_SNAPSHOT_FILE at a persistent disk to keep it across Render deploys.
+STATE_SNAPSHOT_FILE = os.getenv('STATE_SNAPSHOT_FILE', "runtime_state.json")
+
+class StateSnapshot:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.state = self._read() or {}
+
+    def _read(self):
+        # {} when there is no snapshot yet, None when it exists but can't be read
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load state snapshot: {str(e)}")
+            return None
+
+    def _write(self):
+        # Write to a unique temp file and swap it in so a crash never leaves half a snapshot
+        # and concurrent writers never share a temp file
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save state snapshot: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def _locked(self):
+        # The bot and the pricing worker are separate processes sharing this file,
+        # so the read-modify-write also holds an advisory lock on a sidecar file
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update(self, change):
+        # Re-read first so sections saved by another process aren't clobbered;
+        # if the file can't be read, keep the change in memory rather than overwrite it
+        with self._locked():
+            state = self._read()
+            if state is None:
+                print("⚠️ State snapshot unreadable, not saving over it")
+                return change(self.state)
+            self.state = state
+            result = change(self.state)
+            self._write()
+            return result
+
+    def get(self, section, default=None):
+        with self.lock:
+            return self.state.get(section, default)
+
+    def set(self, section, value):
+        self._update(lambda state: state.update({section: value}))
+
+    def pop(self, section):
+        return self._update(lambda state: state.pop(section, None))
+
+snapshot = StateSnapshot(STATE_SNAPSHOT_FILE)
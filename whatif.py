@@ -0,0 +1,46 @@
+import argparse
+import numpy as np
+from profit_engine import what_if, load_tab, sweep, REFERRAL_FEE_RATE, VAT_RATE
+
+def print_sweep(sheet, target_margin, sell_changes, referral_rate, vat_rate):
+    # How many ASINs clear the target margin at each sell-price shift, in one vectorised pass
+    tab = load_tab(sheet)
+    if not tab['asins']:
+        return
+    multipliers = [1 + change / 100 for change in sell_changes]
+    result = sweep(tab['buy_prices'], tab['sell_prices'], tab['fba_fees'],
+                   sell_multipliers=multipliers, fee_schedules=((referral_rate, vat_rate),))
+    print(f"\n=== SELL PRICE SWEEP (target margin {target_margin}%) ===")
+    for j, change in enumerate(sell_changes):
+        margins = result['margin'][:, 0, j, 0]
+        clearing = int((margins >= target_margin).sum())
+        print(f"Sell {change:+.0f}%: {clearing}/{len(tab['asins'])} ASINs clear target | median margin {float(np.median(margins)):.2f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="What-if profit analysis for a tab using stored results")
+    parser.add_argument('sheet', help="Tab name")
+    parser.add_argument('--target-margin', type=float, default=15.0, help="Target profit margin in %%")
+    parser.add_argument('--sell-change', type=float, default=0.0, help="Sell price change in %%, e.g. -10")
+    parser.add_argument('--sweep', default="", help="Comma-separated sell price changes to sweep, e.g. --sweep=-20,-10,0,10")
+    parser.add_argument('--referral-rate', type=float, default=REFERRAL_FEE_RATE * 100, help="Referral fee in %%")
+    parser.add_argument('--vat-rate', type=float, default=VAT_RATE * 100, help="VAT share of the sell price in %%")
+    args = parser.parse_args()
+
+    referral_rate = args.referral_rate / 100
+    vat_rate = args.vat_rate / 100
+    rows = what_if(args.sheet, args.target_margin, args.sell_change, referral_rate, vat_rate)
+    if not rows:
+        print(f"No stored results for sheet '{args.sheet}'. Run an update first.")
+        return
+
+    print(f"{'ASIN':<12} {'Buy':>8} {'Sell':>8} {'Margin%':>8} {'BreakEven':>10} {'TargetBuy':>10} {'Headroom':>9}")
+    for r in rows:
+        print(f"{r['asin']:<12} {r['buy_price']:>8.2f} {r['sell_price']:>8.2f} {r['margin']:>8.2f} "
+              f"{r['break_even_buy']:>10.2f} {r['target_buy']:>10.2f} {r['headroom']:>9.2f}")
+
+    if args.sweep:
+        sell_changes = [float(change) for change in args.sweep.split(',') if change.strip()]
+        print_sweep(args.sheet, args.target_margin, sell_changes, referral_rate, vat_rate)
+
+if __name__ == "__main__":
+    main()